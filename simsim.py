@@ -1,27 +1,62 @@
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import queue
 import random
 import time
+import threading
 import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
+import struct
+import sys
+from array import array
 from collections import deque
 
-# Ansluter till SQLite-databasen och sätter upp logg-tabellen
-conn = sqlite3.connect("SIMSIMDATABASE.db")
-conn.execute("DROP TABLE IF EXISTS simulationLog;")
-cursor = conn.cursor()
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS SimulationLog (
-    step INTEGER PRIMARY KEY,
-    workers INTEGER,
-    food INTEGER,
-    products INTEGER
-)
-""")
-conn.commit()
-conn.close()
+# Resurserna som simulationen räknar, loggar och sammanställer
+RESOURCES = ("workers", "food", "products")
+
+# Utskriftsnivåer: 0 = tyst, 1 = händelser och stegsammanfattning, 2 = full status varje steg
+VERBOSITY = 2
+
+# Nivå som en pågående körning satt för sin egen tråd (se VerbosityScope); utan den gäller VERBOSITY
+_thread_verbosity = threading.local()
+
+# Funktion: set_verbosity - Sätter hur mycket simulationen skriver ut (standardnivån för alla trådar)
+def set_verbosity(level):
+    global VERBOSITY
+    VERBOSITY = level
+
+# Funktion: current_verbosity - Returnerar utskriftsnivån som gäller i den aktuella tråden
+def current_verbosity():
+    level = getattr(_thread_verbosity, "level", None)
+    return VERBOSITY if level is None else level
+
+# Klass: VerbosityScope - Sätter utskriftsnivån för den aktuella tråden i ett with-block och återställer den efteråt
+# run_simulation använder den, så att en körning aldrig ändrar anroparens VERBOSITY eller en annan tråds nivå
+class VerbosityScope:
+    # Konstruktor: Sparar nivån som ska gälla i blocket
+    def __init__(self, level):
+        self.level = level
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_thread_verbosity, "level", None)
+        _thread_verbosity.level = self.level
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _thread_verbosity.level = self.previous
+
+# Funktion: report - Skriver ut ett meddelande om nivån ryms inom aktuell utskriftsnivå
+def report(message, level=2):
+    if current_verbosity() >= level:
+        print(message)
 
 # Klass: Worker - Representerar en arbetare
 class Worker:
+    __slots__ = ("id", "vitality", "location")
+
     # Konstruktor: Initierar en arbetare med id, vitality och plats
     def __init__(self, id, vitality=100):
         self.id = id
@@ -44,8 +79,32 @@ class Worker:
     def return_life(self):
         return self.vitality
 
+# Klass: ReadOnlyGoods - Gör de delade Food- och Product-instanserna skrivskyddade
+# En delad instans ligger i alla lador och förråd samtidigt, så en tilldelning skulle ändra varje sådan enhet
+class ReadOnlyGoods:
+    __slots__ = ()
+
+    # Konstruktor: Sätter id och kvalitet en gång; därefter kan instansen inte ändras
+    def __init__(self, id, quality=1):
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "quality", quality)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} instances are shared and read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} instances are shared and read-only")
+
+    # Funktion: __reduce__ - Packas upp (t.ex. i en annan process) som den delade instansen för samma kvalitet
+    def __reduce__(self):
+        return type(self).shared, (self.quality,)
+
 # Klass: Food - Representerar mat
 class Food:
+    __slots__ = ("id", "quality")
+    # Delade instanser per kvalitet för identiska enheter (id 0), se shared()
+    _shared = {}
+
     # Konstruktor: Initierar mat med id och kvalitet
     def __init__(self, id, quality=1):
         self.id = id
@@ -55,8 +114,24 @@ class Food:
     def return_quality(self):
         return self.quality
 
+    # Funktion: shared - Returnerar en delad (flyweight), skrivskyddad instans för matvaror med id 0 och given kvalitet
+    @classmethod
+    def shared(cls, quality=1):
+        instance = cls._shared.get(quality)
+        if instance is None:
+            instance = cls._shared[quality] = SharedFood(id=0, quality=quality)
+        return instance
+
+# Klass: SharedFood - Skrivskyddad delad matvara som Food.shared delar ut
+class SharedFood(ReadOnlyGoods, Food):
+    __slots__ = ()
+
 # Klass: Product - Representerar en produkt
 class Product:
+    __slots__ = ("id", "quality")
+    # Delade instanser per kvalitet för identiska enheter (id 0), se shared()
+    _shared = {}
+
     # Konstruktor: Initierar en produkt med id och kvalitet
     def __init__(self, id, quality=1):
         self.id = id
@@ -66,101 +141,616 @@ class Product:
     def return_quality(self):
         return self.quality
 
+    # Funktion: shared - Returnerar en delad (flyweight), skrivskyddad instans för produkter med id 0 och given kvalitet
+    @classmethod
+    def shared(cls, quality=1):
+        instance = cls._shared.get(quality)
+        if instance is None:
+            instance = cls._shared[quality] = SharedProduct(id=0, quality=quality)
+        return instance
+
+# Klass: SharedProduct - Skrivskyddad delad produkt som Product.shared delar ut
+class SharedProduct(ReadOnlyGoods, Product):
+    __slots__ = ()
+
+# Klass: ResourceCounters - Löpande summor som behållarna uppdaterar vid varje in- och uttag
+class ResourceCounters:
+    # Konstruktor: Initierar alla summor till noll
+    def __init__(self):
+        self.workers = 0
+        self.food = 0
+        self.products = 0
+
+# Klass: IdAllocator - Delar ut unika, monotont ökande id per entitetstyp
+class IdAllocator:
+    # Konstruktor: Initierar nästa lediga id för varje typ
+    def __init__(self):
+        self.next_ids = {}
+
+    # Funktion: next_id - Returnerar nästa id för en entitetstyp
+    def next_id(self, kind):
+        id = self.next_ids.get(kind, 0)
+        self.next_ids[kind] = id + 1
+        return id
+
+    # Funktion: reserve - Reserverar count id i följd och returnerar det första
+    def reserve(self, kind, count):
+        first_id = self.next_ids.get(kind, 0)
+        self.next_ids[kind] = first_id + count
+        return first_id
+
+# Platskoder för arbetare i den kolumnbaserade populationen
+LOCATIONS = ["Barrack", "Factory", "Home", "Field", "Foodcourt"]
+LOCATION_CODES = {name: code for code, name in enumerate(LOCATIONS)}
+
+# Klass: WorkerPopulation - Lagrar alla arbetare i sammanhängande kolumner för id, vitality och plats
+class WorkerPopulation:
+    # Konstruktor: Initierar tomma kolumner och en lista med lediga platser
+    def __init__(self):
+        self.ids = array('q')
+        self.vitality = array('h')
+        self.location = array('b')
+        self.free = []
+
+    # Funktion: add - Lägger till en arbetare och returnerar dess plats (index) i kolumnerna
+    def add(self, id, vitality=100, location=0):
+        if self.free:
+            index = self.free.pop()
+            self.ids[index] = id
+            self.vitality[index] = vitality
+            self.location[index] = location
+            return index
+        self.ids.append(id)
+        self.vitality.append(vitality)
+        self.location.append(location)
+        return len(self.ids) - 1
+
+    # Funktion: release - Frigör platsen för en arbetare som dött eller tagits bort
+    def release(self, index):
+        self.vitality[index] = 0
+        self.free.append(index)
+
+    # Funktion: add_many - Lägger till count arbetare med löpande id och returnerar deras index
+    def add_many(self, first_id, count, vitality=100):
+        reused = min(count, len(self.free))
+        indices = array('q', self.free[len(self.free) - reused:])
+        del self.free[len(self.free) - reused:]
+        for offset, index in enumerate(indices):
+            self.ids[index] = first_id + offset
+            self.vitality[index] = vitality
+            self.location[index] = 0
+        start = len(self.ids)
+        fresh = count - reused
+        self.ids.extend(range(first_id + reused, first_id + count))
+        self.vitality.extend(array('h', [vitality]) * fresh)
+        self.location.extend(bytes(fresh))
+        indices.extend(range(start, start + fresh))
+        return indices
+
+    # Funktion: release_many - Frigör flera platser på en gång
+    def release_many(self, indices):
+        for index in indices:
+            self.vitality[index] = 0
+        self.free.extend(indices)
+
+    # Funktion: __len__ - Returnerar antalet levande platser
+    def __len__(self):
+        return len(self.ids) - len(self.free)
+
+# Klass: WorkerHandle - Lättviktig vy över en arbetare i WorkerPopulation med samma API som Worker
+class WorkerHandle:
+    __slots__ = ("population", "index")
+
+    # Konstruktor: Binder vyn till en population och ett index
+    def __init__(self, population, index):
+        self.population = population
+        self.index = index
+
+    @property
+    def id(self):
+        return self.population.ids[self.index]
+
+    @property
+    def vitality(self):
+        return self.population.vitality[self.index]
+
+    @vitality.setter
+    def vitality(self, value):
+        self.population.vitality[self.index] = value
+
+    @property
+    def location(self):
+        return LOCATIONS[self.population.location[self.index]]
+
+    @location.setter
+    def location(self, name):
+        self.population.location[self.index] = LOCATION_CODES[name]
+
+    # Funktion: hurt - Minskar arbetarens vitality
+    def hurt(self, amount):
+        vitality = self.population.vitality
+        vitality[self.index] = max(vitality[self.index] - amount, 0)
+
+    # Funktion: heal - Ökar arbetarens vitality
+    def heal(self, amount):
+        vitality = self.population.vitality
+        vitality[self.index] = min(vitality[self.index] + amount, 100)
+
+    # Funktion: return_life - Returnerar arbetarens vitality
+    def return_life(self):
+        return self.population.vitality[self.index]
+
+# Klass: IndexRing - Ringbuffert av index som växer vid behov, med samma kö-operationer som en deque
+class IndexRing:
+    # Konstruktor: Initierar en tom ringbuffert med given kapacitet
+    def __init__(self, capacity=16):
+        self.buffer = array('q', bytes(8 * capacity))
+        self.head = 0
+        self.size = 0
+
+    # Funktion: _grow - Dubblar kapaciteten och lägger elementen i ordning från början
+    def _grow(self):
+        ordered = self.buffer[self.head:] + self.buffer[:self.head]
+        self.buffer = ordered + array('q', bytes(8 * len(ordered)))
+        self.head = 0
+
+    # Funktion: append - Lägger till ett index sist i kön
+    def append(self, index):
+        if self.size == len(self.buffer):
+            self._grow()
+        self.buffer[(self.head + self.size) % len(self.buffer)] = index
+        self.size += 1
+
+    # Funktion: extend - Lägger till en array av index sist i kön
+    def extend(self, indices):
+        if not isinstance(indices, array) or indices.typecode != 'q':
+            indices = array('q', indices)
+        count = len(indices)
+        while self.size + count > len(self.buffer):
+            self._grow()
+        capacity = len(self.buffer)
+        tail = (self.head + self.size) % capacity
+        first = min(count, capacity - tail)
+        self.buffer[tail:tail + first] = indices[:first]
+        self.buffer[:count - first] = indices[first:]
+        self.size += count
+
+    # Funktion: popleft_many - Tar ut upp till count index från början av kön som en array
+    def popleft_many(self, count):
+        count = min(count, self.size)
+        capacity = len(self.buffer)
+        end = self.head + count
+        if end <= capacity:
+            taken = self.buffer[self.head:end]
+        else:
+            taken = self.buffer[self.head:] + self.buffer[:end - capacity]
+        self.head = end % capacity
+        self.size -= count
+        return taken
+
+    # Funktion: popleft - Tar ut det första indexet i kön
+    def popleft(self):
+        if not self.size:
+            raise IndexError("pop from an empty IndexRing")
+        index = self.buffer[self.head]
+        self.head = (self.head + 1) % len(self.buffer)
+        self.size -= 1
+        return index
+
+    # Funktion: pop - Tar ut det sista indexet i kön
+    def pop(self):
+        if not self.size:
+            raise IndexError("pop from an empty IndexRing")
+        self.size -= 1
+        return self.buffer[(self.head + self.size) % len(self.buffer)]
+
+    # Funktion: to_array - Returnerar en kopia av indexen i köordning som en array('q')
+    def to_array(self):
+        end = self.head + self.size
+        if end <= len(self.buffer):
+            return self.buffer[self.head:end]
+        return self.buffer[self.head:] + self.buffer[:end - len(self.buffer)]
+
+    # Funktion: __iter__ - Itererar över indexen från först till sist
+    def __iter__(self):
+        capacity = len(self.buffer)
+        for offset in range(self.size):
+            yield self.buffer[(self.head + offset) % capacity]
+
+    def __len__(self):
+        return self.size
+
 # Klass: Barrack - Hanterar en kö av arbetare
 class Barrack:
-    # Konstruktor: Initierar en barrack med en deque för arbetare
-    def __init__(self):
-        self.queue = deque()
+    # Konstruktor: Initierar en barrack med en deque för arbetare, eller en indexkö över en WorkerPopulation
+    def __init__(self, population=None, counters=None):
+        self.population = population
+        self.counters = counters if counters is not None else ResourceCounters()
+        self.queue = deque() if population is None else IndexRing()
 
     # Funktion: in_worker - Lägger till en arbetare i barracken
     def in_worker(self, worker):
-        worker.location = "Barrack"
-        self.queue.append(worker)
+        if self.population is None:
+            worker.location = "Barrack"
+            self.queue.append(worker)
+        elif isinstance(worker, WorkerHandle) and worker.population is self.population:
+            self.population.location[worker.index] = 0
+            self.queue.append(worker.index)
+        else:
+            self.queue.append(self.population.add(worker.id, worker.vitality))
+        self.counters.workers += 1
+
+    # Funktion: spawn_worker - Skapar en ny arbetare direkt i barracken
+    def spawn_worker(self, id, vitality=100):
+        if self.population is None:
+            self.queue.append(Worker(id=id, vitality=vitality))
+        else:
+            self.queue.append(self.population.add(id, vitality))
+        self.counters.workers += 1
+
+    # Funktion: spawn_workers - Skapar count nya arbetare med löpande id från first_id
+    def spawn_workers(self, count, first_id, vitality=100):
+        if self.population is None:
+            self.queue.extend(Worker(id=id, vitality=vitality) for id in range(first_id, first_id + count))
+            self.counters.workers += count
+        else:
+            self.put_workers(self.population.add_many(first_id, count, vitality))
 
     # Funktion: out_worker - Tar ut en arbetare från barracken
     def out_worker(self):
         if self.queue:
-            return self.queue.popleft()
+            self.counters.workers -= 1
+            if self.population is None:
+                return self.queue.popleft()
+            return WorkerHandle(self.population, self.queue.popleft())
+
+    # Funktion: take_workers - Tar ut upp till count arbetare på en gång som en array av index (kräver population)
+    def take_workers(self, count):
+        taken = self.queue.popleft_many(count)
+        self.counters.workers -= len(taken)
+        return taken
+
+    # Funktion: put_workers - Lägger en array av index sist i kön (kräver population)
+    def put_workers(self, indices):
+        self.queue.extend(indices)
+        self.counters.workers += len(indices)
+
+    # Funktion: discard_worker - Släpper en uttagen arbetare som inte kommer tillbaka (t.ex. död)
+    def discard_worker(self, worker):
+        if self.population is not None:
+            self.population.release(worker.index)
+
+    # Funktion: remove_workers - Tar bort upp till count arbetare från slutet av kön
+    def remove_workers(self, count):
+        removed = 0
+        while self.queue and removed < count:
+            index = self.queue.pop()
+            if self.population is not None:
+                self.population.release(index)
+            removed += 1
+        self.counters.workers -= removed
+        return removed
+
+    # Funktion: emigrate_workers - Tar bort upp till count arbetare från slutet av kön och returnerar deras vitality
+    def emigrate_workers(self, count):
+        vitalities = []
+        while self.queue and len(vitalities) < count:
+            if self.population is None:
+                vitalities.append(self.queue.pop().vitality)
+            else:
+                index = self.queue.pop()
+                vitalities.append(self.population.vitality[index])
+                self.population.release(index)
+        self.counters.workers -= len(vitalities)
+        return vitalities
 
     # Funktion: exist_worker - Kontrollerar om det finns arbetare i barracken
     def exist_worker(self):
         return len(self.queue) > 0
 
+# Klass: QualityBlocks - FIFO av run-length-block [kvalitet, antal] med O(1) massinsättning och massuttag
+class QualityBlocks:
+    # Konstruktor: Initierar en tom kö av block
+    def __init__(self):
+        self.blocks = deque()
+        self.size = 0
+
+    # Funktion: append - Lägger till count enheter av en kvalitet sist i kön
+    def append(self, quality, count=1):
+        if count <= 0:
+            return
+        if self.blocks and self.blocks[-1][0] == quality:
+            self.blocks[-1][1] += count
+        else:
+            self.blocks.append([quality, count])
+        self.size += count
+
+    # Funktion: popleft - Tar ut den första enheten och returnerar dess kvalitet
+    def popleft(self):
+        block = self.blocks[0]
+        block[1] -= 1
+        if block[1] == 0:
+            self.blocks.popleft()
+        self.size -= 1
+        return block[0]
+
+    # Funktion: pop - Tar ut den sista enheten och returnerar dess kvalitet
+    def pop(self):
+        block = self.blocks[-1]
+        block[1] -= 1
+        if block[1] == 0:
+            self.blocks.pop()
+        self.size -= 1
+        return block[0]
+
+    # Funktion: take - Tar ut upp till count enheter från början och returnerar dem som (kvalitet, antal)-block
+    def take(self, count):
+        taken = []
+        while count > 0 and self.blocks:
+            block = self.blocks[0]
+            n = min(count, block[1])
+            taken.append((block[0], n))
+            block[1] -= n
+            if block[1] == 0:
+                self.blocks.popleft()
+            self.size -= n
+            count -= n
+        return taken
+
+    # Funktion: drop - Tar bort upp till count enheter från slutet och returnerar antalet borttagna
+    def drop(self, count):
+        removed = 0
+        while removed < count and self.blocks:
+            block = self.blocks[-1]
+            n = min(count - removed, block[1])
+            block[1] -= n
+            if block[1] == 0:
+                self.blocks.pop()
+            self.size -= n
+            removed += n
+        return removed
+
+    # Funktion: __iter__ - Itererar över blocken som (kvalitet, antal) från först till sist
+    def __iter__(self):
+        for quality, count in self.blocks:
+            yield quality, count
+
+    def __len__(self):
+        return self.size
+
 # Klass: Storage - Hanterar lagring av produkter
 class Storage:
-    # Konstruktor: Initierar ett förråd med en deque för produkter
-    def __init__(self):
-        self.storage = deque()
+    # Konstruktor: Initierar ett förråd med en deque för produkter, eller kvalitetsräknare om counted är satt
+    def __init__(self, counted=False, counters=None):
+        self.counted = counted
+        self.counters = counters if counters is not None else ResourceCounters()
+        self.storage = QualityBlocks() if counted else deque()
 
     # Funktion: in_product - Lägger till en produkt i förrådet
     def in_product(self, product):
-        self.storage.append(product)
+        if self.counted:
+            self.storage.append(product.quality)
+        else:
+            self.storage.append(product)
+        self.counters.products += 1
+
+    # Funktion: add_products - Lägger till count produkter av samma kvalitet på en gång (löpande id från first_id)
+    def add_products(self, count, quality=1, first_id=None):
+        if self.counted:
+            self.storage.append(quality, count)
+        else:
+            if first_id is None:
+                self.storage.extend([Product.shared(quality)] * count)
+            else:
+                self.storage.extend(Product(id=id, quality=quality) for id in range(first_id, first_id + count))
+        self.counters.products += count
 
     # Funktion: out_product - Tar ut en produkt från förrådet
     def out_product(self):
         if self.storage:
+            self.counters.products -= 1
+            if self.counted:
+                return Product.shared(self.storage.popleft())
             return self.storage.popleft()
 
+    # Funktion: take_products - Tar ut upp till count produkter från början som (kvalitet, antal)-block (kräver counted)
+    def take_products(self, count):
+        taken = self.storage.take(count)
+        self.counters.products -= sum(n for _, n in taken)
+        return taken
+
+    # Funktion: remove_products - Tar bort upp till count produkter från slutet av förrådet
+    def remove_products(self, count):
+        if self.counted:
+            removed = self.storage.drop(count)
+        else:
+            removed = 0
+            while self.storage and removed < count:
+                self.storage.pop()
+                removed += 1
+        self.counters.products -= removed
+        return removed
+
+    # Funktion: emigrate_products - Tar bort upp till count produkter från slutet och returnerar {kvalitet: antal}
+    def emigrate_products(self, count):
+        qualities = {}
+        removed = 0
+        while self.storage and removed < count:
+            item = self.storage.pop()
+            quality = item if self.counted else item.quality
+            qualities[quality] = qualities.get(quality, 0) + 1
+            removed += 1
+        self.counters.products -= removed
+        return qualities
+
     # Funktion: exist_product - Kontrollerar om det finns produkter i förrådet
     def exist_product(self):
         return len(self.storage) > 0
 
 # Klass: Shed - Hanterar lagring av mat
 class Shed:
-    # Konstruktor: Initierar en lada med en deque för mat
-    def __init__(self):
-        self.queue = deque()
+    # Konstruktor: Initierar en lada med en deque för mat, eller kvalitetsräknare om counted är satt
+    def __init__(self, counted=False, counters=None):
+        self.counted = counted
+        self.counters = counters if counters is not None else ResourceCounters()
+        self.queue = QualityBlocks() if counted else deque()
 
     # Funktion: in_food - Lägger till en matvara i ladan
     def in_food(self, food):
-        self.queue.append(food)
+        if self.counted:
+            self.queue.append(food.quality)
+        else:
+            self.queue.append(food)
+        self.counters.food += 1
+
+    # Funktion: add_food - Lägger till count matvaror av samma kvalitet på en gång (löpande id från first_id)
+    def add_food(self, count, quality=1, first_id=None):
+        if self.counted:
+            self.queue.append(quality, count)
+        else:
+            if first_id is None:
+                self.queue.extend([Food.shared(quality)] * count)
+            else:
+                self.queue.extend(Food(id=id, quality=quality) for id in range(first_id, first_id + count))
+        self.counters.food += count
 
     # Funktion: out_food - Tar ut en matvara från ladan
     def out_food(self):
         if self.queue:
+            self.counters.food -= 1
+            if self.counted:
+                return Food.shared(self.queue.popleft())
             return self.queue.popleft()
 
+    # Funktion: take_food - Tar ut upp till count matvaror från början som (kvalitet, antal)-block (kräver counted)
+    def take_food(self, count):
+        taken = self.queue.take(count)
+        self.counters.food -= sum(n for _, n in taken)
+        return taken
+
+    # Funktion: remove_food - Tar bort upp till count matvaror från slutet av ladan
+    def remove_food(self, count):
+        if self.counted:
+            removed = self.queue.drop(count)
+        else:
+            removed = 0
+            while self.queue and removed < count:
+                self.queue.pop()
+                removed += 1
+        self.counters.food -= removed
+        return removed
+
+    # Funktion: emigrate_food - Tar bort upp till count matvaror från slutet och returnerar {kvalitet: antal}
+    def emigrate_food(self, count):
+        qualities = {}
+        removed = 0
+        while self.queue and removed < count:
+            item = self.queue.pop()
+            quality = item if self.counted else item.quality
+            qualities[quality] = qualities.get(quality, 0) + 1
+            removed += 1
+        self.counters.food -= removed
+        return qualities
+
     # Funktion: exist_food - Kontrollerar om det finns mat i ladan
     def exist_food(self):
         return len(self.queue) > 0
 
+# Mål för minne per entitet i bytes, inklusive platsen i kön (mätt med tracemalloc, se measure_entity_memory)
+MEMORY_TARGETS = {
+    "worker": 100,          # Worker med __slots__ i en deque
+    "columnar_worker": 32,  # arbetare i WorkerPopulation + IndexRing
+    "food": 16,             # delad Food-instans i en deque
+    "product": 16,          # delad Product-instans i en deque
+}
+
+# Funktion: measure_entity_memory - Mäter minne per entitet genom att fylla behållare med count enheter
+def measure_entity_memory(count=100_000):
+    import gc
+    import tracemalloc
+
+    # Varje post skapar en tom behållare och en funktion som fyller den
+    builders = {
+        "worker": (Barrack, lambda c: c.spawn_workers(count, first_id=1000)),
+        "columnar_worker": (lambda: Barrack(WorkerPopulation()), lambda c: c.spawn_workers(count, first_id=1000)),
+        "food": (Shed, lambda c: c.add_food(count)),
+        "product": (Storage, lambda c: c.add_products(count)),
+    }
+    results = {}
+    for name, (make, fill) in builders.items():
+        container = make()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fill(container)
+            results[name] = tracemalloc.get_traced_memory()[0] / count
+        finally:
+            tracemalloc.stop()
+        del container
+    return results
+
+# Funktion: check_memory_targets - Returnerar de entiteter som överskrider sina mål i MEMORY_TARGETS
+def check_memory_targets(count=100_000):
+    measured = measure_entity_memory(count)
+    return {name: (size, MEMORY_TARGETS[name]) for name, size in measured.items() if size > MEMORY_TARGETS[name]}
+
+# Utfall som produce() returnerar, så att instrumenteringen kan räkna varför en övergång lyckades eller misslyckades
+OUTCOME_OK = "ok"
+OUTCOME_INACTIVE = "inactive"
+OUTCOME_WORKER_DIED = "worker_died"
+OUTCOME_NO_WORKER = "no_worker"
+OUTCOME_NO_PRODUCT = "no_product"
+OUTCOME_NO_FOOD = "no_food"
+OUTCOME_NO_PARTNER = "no_partner"
+OUTCOME_ERROR = "error"
+
 # Klass: Factory - Representerar en fabrik för att producera produkter
 class Factory:
     # Konstruktor: Initierar en fabrik med input/output barrack och förråd
-    def __init__(self, barrack_in, barrack_out, storage, set_active=True):
+    def __init__(self, barrack_in, barrack_out, storage, set_active=True, rng=None, rate=1.0, duration=0.0):
         self.barrack_in = barrack_in
         self.barrack_out = barrack_out
         self.storage = storage
         self.set_active = set_active
+        self.rng = rng if rng is not None else random
+        # Takt (avfyrningar per tick) och varaktighet (upptagen tid i tick) för händelseschemaläggaren
+        self.rate = rate
+        self.duration = duration
         self.name = "Factory"
 
-    # Funktion: produce - Producerar en produkt med hjälp av en arbetare
+    # Funktion: produce - Producerar en produkt med hjälp av en arbetare och returnerar utfallet
     def produce(self):
         if self.set_active:
             worker = self.barrack_in.out_worker()
             if worker:
                 worker.location = "Factory"
-                worker.hurt(random.randint(1, 3))
+                worker.hurt(self.rng.randint(1, 3))
                 if worker.return_life() > 0:
-                    self.storage.in_product(Product(id=0))
+                    self.storage.in_product(Product.shared())
                     self.barrack_out.in_worker(worker)
-                else:
-                    print("Worker died in the factory")
-        else:
-            return None
+                    return OUTCOME_OK
+                self.barrack_in.discard_worker(worker)
+                report("Worker died in the factory")
+                return OUTCOME_WORKER_DIED
+            return OUTCOME_NO_WORKER
+        return OUTCOME_INACTIVE
 
 # Klass: Home - Representerar ett hem som kan öka befolkningen
 class Home:
     # Konstruktor: Initierar ett hem med input/output barrack, förråd och referens till simulationen
-    def __init__(self, barrack_in, barrack_out, storage, simulation, set_active=True):
+    def __init__(self, barrack_in, barrack_out, storage, simulation, set_active=True, rng=None, rate=1.0, duration=0.0):
         self.barrack_in = barrack_in
         self.barrack_out = barrack_out
         self.storage = storage
         self.simulation = simulation
         self.set_active = set_active
+        self.rng = rng if rng is not None else random
+        # Takt (avfyrningar per tick) och varaktighet (upptagen tid i tick) för händelseschemaläggaren
+        self.rate = rate
+        self.duration = duration
         self.name = "Home"
 
-    # Funktion: produce - Producerar genom att använda en arbetare och en produkt för att skapa en ny arbetare
+    # Funktion: produce - Producerar genom att använda en arbetare och en produkt för att skapa en ny arbetare och returnerar utfallet
     def produce(self):
         if self.set_active:
             worker1 = self.barrack_in.out_worker()
@@ -168,56 +758,65 @@ class Home:
                 worker1.location = "Home"
                 product = self.storage.out_product()
                 if product:
-                    worker1.heal(random.randint(10, 20))
+                    worker1.heal(self.rng.randint(10, 20))
                     worker2 = self.barrack_in.out_worker()
                     if worker2:
-                        new_worker_id = self.simulation.count_total_workers()
-                        self.barrack_out.in_worker(Worker(id=new_worker_id + 1))
+                        new_worker_id = self.simulation.ids.next_id("worker")
+                        self.barrack_out.spawn_worker(id=new_worker_id)
                         self.barrack_out.in_worker(worker1)
                         self.barrack_out.in_worker(worker2)
-                    else:
-                        self.barrack_out.in_worker(worker1)
-                else:
-                    print("No product available in Home.produce")
-            else:
-                print("No worker available in Home.produce")
-        else:
-            return None
+                        return OUTCOME_OK
+                    self.barrack_out.in_worker(worker1)
+                    return OUTCOME_NO_PARTNER
+                self.barrack_in.discard_worker(worker1)
+                report("No product available in Home.produce")
+                return OUTCOME_NO_PRODUCT
+            report("No worker available in Home.produce")
+            return OUTCOME_NO_WORKER
+        return OUTCOME_INACTIVE
 
 # Klass: Farm - Representerar en gård för att producera mat
 class Farm:
     # Konstruktor: Initierar en gård med input/output barrack och lada
-    def __init__(self, barrack_in, barrack_out, shed, set_active=True):
+    def __init__(self, barrack_in, barrack_out, shed, set_active=True, rng=None, rate=1.0, duration=0.0):
         self.barrack_in = barrack_in
         self.barrack_out = barrack_out
         self.shed = shed
         self.set_active = set_active
+        self.rng = rng if rng is not None else random
+        # Takt (avfyrningar per tick) och varaktighet (upptagen tid i tick) för händelseschemaläggaren
+        self.rate = rate
+        self.duration = duration
         self.name = "Farm"
 
-    # Funktion: produce - Producerar mat med hjälp av en arbetare
+    # Funktion: produce - Producerar mat med hjälp av en arbetare och returnerar utfallet
     def produce(self):
         if self.set_active:
             worker = self.barrack_in.out_worker()
             if worker:
                 worker.location = "Field"
-                self.shed.in_food(Food(id=0))
+                self.shed.in_food(Food.shared())
                 self.barrack_out.in_worker(worker)
-            else:
-                print("No worker available in Farm.produce")
-        else:
-            return None
+                return OUTCOME_OK
+            report("No worker available in Farm.produce")
+            return OUTCOME_NO_WORKER
+        return OUTCOME_INACTIVE
 
 # Klass: Foodcourt - Representerar en matplats där mat bearbetas
 class Foodcourt:
     # Konstruktor: Initierar en matplats med input/output barrack och lada
-    def __init__(self, barrack_in, barrack_out, shed, set_active=True):
+    def __init__(self, barrack_in, barrack_out, shed, set_active=True, rng=None, rate=1.0, duration=0.0):
         self.barrack_in = barrack_in
         self.barrack_out = barrack_out
         self.shed = shed
         self.set_active = set_active
+        self.rng = rng if rng is not None else random
+        # Takt (avfyrningar per tick) och varaktighet (upptagen tid i tick) för händelseschemaläggaren
+        self.rate = rate
+        self.duration = duration
         self.name = "Foodcourt"
 
-    # Funktion: produce - Producerar genom att bearbeta mat med en arbetare
+    # Funktion: produce - Producerar genom att bearbeta mat med en arbetare och returnerar utfallet
     def produce(self):
         if self.set_active:
             worker = self.barrack_in.out_worker()
@@ -225,74 +824,1350 @@ class Foodcourt:
             if worker and food:
                 worker.location = "Foodcourt"
                 if food.return_quality() == 1:
-                    worker.heal(food.return_quality() * random.randint(1, 10))
+                    worker.heal(food.return_quality() * self.rng.randint(1, 10))
                 else:
-                    worker.hurt(random.randint(1, 5))
+                    worker.hurt(self.rng.randint(1, 5))
                 self.barrack_out.in_worker(worker)
-            elif worker:
+                return OUTCOME_OK
+            if worker:
                 self.barrack_out.in_worker(worker)
+                return OUTCOME_NO_FOOD
+            report("No worker available in Foodcourt.produce")
+            return OUTCOME_NO_WORKER
+        return OUTCOME_INACTIVE
+
+# Klass: StagnationDetector - Glidande fönster med monotona köer för min/max per resurs
+class StagnationDetector:
+    # Konstruktor: Initierar fönstret; delta är ett tal eller en dict med tröskel per resurs
+    def __init__(self, window=15, delta=5, resources=RESOURCES):
+        self.window = window
+        self.resources = tuple(resources)
+        self.delta = dict(delta) if isinstance(delta, dict) else {res: delta for res in self.resources}
+        self.count = 0
+        self.first_index = None
+        self.last_index = -1
+        self.maxima = {res: deque() for res in self.resources}
+        self.minima = {res: deque() for res in self.resources}
+
+    # Funktion: _expire - Släpper värden som fallit ur fönstret (de window senaste stegen före index)
+    def _expire(self, index):
+        oldest = index - self.window
+        for res in self.resources:
+            for queue in (self.maxima[res], self.minima[res]):
+                while queue and queue[0][0] < oldest:
+                    queue.popleft()
+
+    # Funktion: moved - Kontrollerar om resursen avviker mer än delta från något värde i fönstret
+    def moved(self, res, value):
+        delta = self.delta[res]
+        return self.maxima[res][0][1] - value > delta or value - self.minima[res][0][1] > delta
+
+    # Funktion: update - Jämför nuvarande värden mot fönstret, lägger sedan till dem; returnerar True vid stagnation
+    # Utan step räknas varje anrop som ett steg; med step (t.ex. i batch-läget) mäts fönstret i steg
+    def update(self, counts, step=None):
+        index = self.last_index + 1 if step is None else step
+        self._expire(index)
+        if self.first_index is None:
+            self.first_index = index
+        # Precis som tidigare krävs en full historik (mer än ett fönster bakåt) innan stagnation kan upptäckas
+        stagnant = (index - self.first_index > self.window and bool(self.maxima[self.resources[0]])
+                    and not any(self.moved(res, counts[res]) for res in self.resources))
+        for res in self.resources:
+            value = counts[res]
+            maxima = self.maxima[res]
+            while maxima and maxima[-1][1] <= value:
+                maxima.pop()
+            maxima.append((index, value))
+            minima = self.minima[res]
+            while minima and minima[-1][1] >= value:
+                minima.pop()
+            minima.append((index, value))
+        self.count += 1
+        self.last_index = index
+        return stagnant
+
+    # Funktion: spread - Returnerar max - min för en resurs inom fönstret
+    def spread(self, res):
+        self._expire(self.last_index + 1)
+        if not self.maxima[res]:
+            return 0
+        return self.maxima[res][0][1] - self.minima[res][0][1]
+
+    # Funktion: reset - Tömmer historiken
+    def reset(self):
+        self.count = 0
+        self.first_index = None
+        self.last_index = -1
+        for res in self.resources:
+            self.maxima[res].clear()
+            self.minima[res].clear()
+
+# Klass: RandomScheduler - Ursprunglig policy: en slumpmässigt vald byggnad producerar varje tick
+class RandomScheduler:
+    # Konstruktor: Binder schemaläggaren till simulationens slumpgenerator
+    def __init__(self, rng):
+        self.rng = rng
+
+    # Funktion: select - Returnerar byggnaderna som ska avfyras detta tick
+    def select(self, simulation, tick):
+        return [self.rng.choice(simulation.transitions)]
+
+    # Funktion: invalidate - Inget sparat att glömma för den slumpmässiga policyn
+    def invalidate(self):
+        pass
+
+# Klass: WeightedScheduler - Avfyrar flera byggnader per tick, viktade efter takt och prioritet
+class WeightedScheduler:
+    # Konstruktor: Initierar antal avfyrningar per tick och förstärkningen för prioriterade byggnader
+    def __init__(self, rng, firings_per_tick=4, priority_boost=2.0):
+        self.rng = rng
+        self.firings_per_tick = firings_per_tick
+        self.priority_boost = priority_boost
+        # Aktiva byggnader och kumulativa vikter för den senaste prioritetsgruppen (None = inte beräknade)
+        self.group = None
+        self.active = []
+        self.cum_weights = []
+
+    # Funktion: select - Drar firings_per_tick byggnader med vikt rate, förstärkt för byggnaderna som evaluate_resource_balance pekar ut
+    # Vikterna räknas bara om när prioritetsgruppen byts, så ett tick kostar inte O(antal byggnader)
+    def select(self, simulation, tick):
+        group = tuple(id(building) for building in simulation.evaluate_resource_balance())
+        if group != self.group:
+            self.group = group
+            self.active = [building for building in simulation.transitions if building.set_active]
+            self.cum_weights = list(itertools.accumulate(
+                building.rate * (self.priority_boost if id(building) in group else 1.0) for building in self.active))
+        if not self.active:
+            return []
+        return self.rng.choices(self.active, cum_weights=self.cum_weights, k=self.firings_per_tick)
+
+    # Funktion: invalidate - Glömmer de sparade vikterna, t.ex. när en byggnad aktiverats eller avaktiverats
+    def invalidate(self):
+        self.group = None
+
+# Klass: EventScheduler - Diskret händelsestyrd schemaläggare med prioritetskö över nästa avfyrningstid
+class EventScheduler:
+    # Konstruktor: Initierar en tom händelsekö; max_firings_per_tick skyddar mot skenande takter
+    def __init__(self, rng, priority_boost=2.0, max_firings_per_tick=1000):
+        self.rng = rng
+        self.priority_boost = priority_boost
+        self.max_firings_per_tick = max_firings_per_tick
+        self.queue = []
+        self.busy_until = {}
+        self.versions = {}
+        self.multipliers = {}
+        self.sequence = 0
+        # Prioritetsgruppen som multiplikatorerna senast sattes för (None = inte beräknade)
+        self.group = None
+
+    # Funktion: _schedule - Lägger nästa avfyrning för en byggnad i kön (exponentiell väntetid efter upptagen tid)
+    def _schedule(self, index, building, now):
+        rate = building.rate * self.multipliers.get(index, 1.0)
+        self.versions[index] = self.versions.get(index, 0) + 1
+        if rate <= 0:
+            return
+        start = max(now, self.busy_until.get(index, 0.0))
+        heapq.heappush(self.queue, (start + self.rng.expovariate(rate), self.sequence, index, self.versions[index]))
+        self.sequence += 1
+
+    # Funktion: select - Uppdaterar prioriteterna och returnerar alla byggnader vars händelser infaller detta tick
+    # Byggnaderna gås bara igenom när prioritetsgruppen byts; annars kostar ett tick bara de händelser som infaller
+    def select(self, simulation, tick):
+        transitions = simulation.transitions
+        group = tuple(id(building) for building in simulation.evaluate_resource_balance())
+        if group != self.group:
+            self.group = group
+            for index, building in enumerate(transitions):
+                multiplier = self.priority_boost if id(building) in group else 1.0
+                # Exponentiella väntetider är minneslösa, så väntande händelser kan dras om när takten ändras
+                if self.multipliers.get(index) != multiplier:
+                    self.multipliers[index] = multiplier
+                    self._schedule(index, building, float(tick))
+
+        fired = []
+        while self.queue and self.queue[0][0] < tick + 1 and len(fired) < self.max_firings_per_tick:
+            time_at, _, index, version = heapq.heappop(self.queue)
+            if version != self.versions[index]:
+                continue
+            building = transitions[index]
+            if building.set_active:
+                fired.append(building)
+            self.busy_until[index] = time_at + building.duration
+            self._schedule(index, building, time_at)
+        return fired
+
+    # Funktion: invalidate - Går igenom byggnaderna igen vid nästa tick, t.ex. efter att en byggnad aktiverats
+    def invalidate(self):
+        self.group = None
+
+# Funktion: make_scheduler - Skapar schemaläggaren som konfigurationen anger
+def make_scheduler(config, rng):
+    if config.scheduler == "random":
+        return RandomScheduler(rng)
+    if config.scheduler == "weighted":
+        return WeightedScheduler(rng, config.firings_per_tick, config.priority_boost)
+    if config.scheduler == "event":
+        return EventScheduler(rng, config.priority_boost)
+    raise ValueError(f"Unknown scheduler: {config.scheduler}")
+
+# Klass: BatchTick - Approximativ tau-leaping: varje byggnad avfyras k gånger i en vektoriserad operation
+class BatchTick:
+    # Konstruktor: Kräver kolumnbaserade arbetare och räknade lager; max_fraction begränsar hur stor del av en behållare ett hopp får tömma
+    def __init__(self, simulation, tau=10, max_fraction=0.05):
+        import numpy as np
+        if simulation.population is None or not all(container.counted for container in simulation.sheds + simulation.storages):
+            raise ValueError("Batch tick mode needs columnar_workers=True and counted_inventory=True")
+        self.np = np
+        self.simulation = simulation
+        self.tau = tau
+        self.max_fraction = max_fraction
+        # Generatorn lever i simulationen så att den följer med i ögonblicksbilder och fortsätter mellan körningar
+        if simulation.batch_rng is None:
+            simulation.batch_rng = np.random.default_rng(simulation.rng.getrandbits(63))
+        self.rng = simulation.batch_rng
+
+    # Funktion: _firing_weights - Förväntade avfyrningar per tick för varje byggnad enligt schemaläggarens policy
+    def _firing_weights(self):
+        simulation = self.simulation
+        config = simulation.config
+        transitions = simulation.transitions
+        if config.scheduler == "random":
+            return [1.0 / len(transitions)] * len(transitions)
+        prioritized = {id(building) for building in simulation.evaluate_resource_balance()}
+        weights = [building.rate * (config.priority_boost if id(building) in prioritized else 1.0)
+                   if building.set_active else 0.0 for building in transitions]
+        if config.scheduler == "weighted":
+            total = sum(weights) or 1.0
+            return [config.firings_per_tick * weight / total for weight in weights]
+        return weights
+
+    # Funktion: _leap_size - Väljer hoppets längd så att ingen behållare förväntas tömmas mer än max_fraction
+    def _leap_size(self, weights, limit):
+        demand = {}
+        for building, weight in zip(self.simulation.transitions, weights):
+            # Home tar två arbetare och en produkt, Foodcourt en arbetare och en matvara
+            demand[id(building.barrack_in)] = demand.get(id(building.barrack_in), 0.0) + weight * (2 if building.name == "Home" else 1)
+            if building.name == "Home":
+                demand[id(building.storage)] = demand.get(id(building.storage), 0.0) + weight
+            elif building.name == "Foodcourt":
+                demand[id(building.shed)] = demand.get(id(building.shed), 0.0) + weight
+        tau = min(self.tau, limit)
+        containers = self.simulation.barracks + self.simulation.storages + self.simulation.sheds
+        for container in containers:
+            rate = demand.get(id(container), 0.0)
+            size = len(container.storage) if isinstance(container, Storage) else len(container.queue)
+            if rate > 0:
+                tau = min(tau, max(1, int(self.max_fraction * size / rate)))
+        return max(1, tau)
+
+    # Funktion: _indices - Numpy-vy (kopia) av en array med index
+    def _indices(self, indices):
+        return self.np.frombuffer(indices, dtype=self.np.int64).copy() if len(indices) else self.np.empty(0, self.np.int64)
+
+    # Funktion: _as_array - Gör om en numpy-array med index till en array('q')
+    def _as_array(self, values):
+        result = array('q')
+        result.frombytes(self.np.ascontiguousarray(values, dtype=self.np.int64).tobytes())
+        return result
+
+    # Funktion: _update_vitality - Lägger till deltan på arbetarnas vitality, klipper till [0, 100] och returnerar de nya värdena
+    def _update_vitality(self, indices, deltas):
+        vitality = self.np.frombuffer(self.simulation.population.vitality, dtype=self.np.int16)
+        values = self.np.clip(vitality[indices].astype(self.np.int32) + deltas, 0, 100)
+        vitality[indices] = values
+        return values
+
+    # Funktion: leap - Avfyrar alla byggnader för ett hopp och returnerar antalet tick som hoppet motsvarar
+    def leap(self, limit):
+        weights = self._firing_weights()
+        tau = self._leap_size(weights, limit)
+        if self.simulation.config.scheduler == "random":
+            firings = self.rng.multinomial(tau, weights)
+        else:
+            firings = self.rng.poisson(self.np.asarray(weights) * tau)
+        for building, k in zip(self.simulation.transitions, firings):
+            if k and building.set_active:
+                getattr(self, f"_fire_{building.name.lower()}")(building, int(k))
+        return tau
+
+    # Funktion: _fire_factory - k fabriksavfyrningar: skada, överlevare ger produkter, döda frigörs
+    def _fire_factory(self, building, k):
+        indices = self._indices(building.barrack_in.take_workers(k))
+        if not len(indices):
+            return
+        values = self._update_vitality(indices, -self.rng.integers(1, 4, len(indices)))
+        alive = values > 0
+        survivors = indices[alive]
+        building.storage.add_products(len(survivors))
+        building.barrack_out.put_workers(self._as_array(survivors))
+        self.simulation.population.release_many(indices[~alive].tolist())
+
+    # Funktion: _fire_farm - k gårdsavfyrningar: k matvaror och arbetarna flyttas vidare
+    def _fire_farm(self, building, k):
+        indices = building.barrack_in.take_workers(k)
+        building.shed.add_food(len(indices))
+        building.barrack_out.put_workers(indices)
+
+    # Funktion: _fire_foodcourt - k avfyrningar: arbetare med mat av kvalitet 1 läker, annan kvalitet skadar
+    def _fire_foodcourt(self, building, k):
+        np = self.np
+        indices = self._indices(building.barrack_in.take_workers(k))
+        # Som i produce() förbrukas en matvara per avfyrning även när ingen arbetare fanns
+        blocks = building.shed.take_food(k)
+        qualities = np.repeat([quality for quality, _ in blocks], [n for _, n in blocks]).astype(np.int32)
+        fed = min(len(indices), len(qualities))
+        if fed:
+            qualities = qualities[:fed]
+            deltas = np.where(qualities == 1,
+                              qualities * self.rng.integers(1, 11, fed),
+                              -self.rng.integers(1, 6, fed))
+            self._update_vitality(indices[:fed], deltas)
+        building.barrack_out.put_workers(self._as_array(indices))
+
+    # Funktion: _fire_home - k hemavfyrningar: arbetare med produkt läker, par ger nya arbetare, utan produkt försvinner arbetaren
+    def _fire_home(self, building, k):
+        simulation = self.simulation
+        indices = self._indices(building.barrack_in.take_workers(k))
+        if not len(indices):
+            return
+        served = sum(n for _, n in building.storage.take_products(len(indices)))
+        simulation.population.release_many(indices[served:].tolist())
+        indices = indices[:served]
+        if not served:
+            return
+        self._update_vitality(indices, self.rng.integers(10, 21, served))
+        partners = building.barrack_in.take_workers(served)
+        births = len(partners)
+        if births:
+            first_id = simulation.ids.reserve("worker", births)
+            building.barrack_out.put_workers(simulation.population.add_many(first_id, births))
+        building.barrack_out.put_workers(self._as_array(indices))
+        building.barrack_out.put_workers(partners)
+
+# Upplösningar (steg per hink) för rollup-tabellen; varje upplösning måste dela nästa så att de kan byggas av varandra
+ROLLUP_RESOLUTIONS = (10, 100, 1000, 10_000)
+
+# SQL-uttryck för rollup-kolumnerna: antal samt min, max och summa per resurs
+ROLLUP_COLUMNS = "count, " + ", ".join(f"{res}_min, {res}_max, {res}_sum" for res in RESOURCES)
+ROLLUP_FROM_LOG = "COUNT(*), " + ", ".join(f"MIN({res}), MAX({res}), SUM({res})" for res in RESOURCES)
+ROLLUP_FROM_ROLLUP = "SUM(count), " + ", ".join(f"MIN({res}_min), MAX({res}_max), SUM({res}_sum)" for res in RESOURCES)
+
+# Funktion: create_log_schema - Skapar SimulationLog, SimulationRuns och SimulationRollup och migrerar en gammal logg utan run_id
+def create_log_schema(connection):
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(SimulationLog)")]
+    legacy = bool(columns) and "run_id" not in columns
+    if legacy:
+        connection.execute("ALTER TABLE SimulationLog RENAME TO SimulationLogLegacy")
+    connection.execute("""
+    CREATE TABLE IF NOT EXISTS SimulationLog (
+        run_id INTEGER NOT NULL,
+        step INTEGER NOT NULL,
+        workers INTEGER,
+        food INTEGER,
+        products INTEGER,
+        PRIMARY KEY (run_id, step)
+    ) WITHOUT ROWID
+    """)
+    connection.execute("""
+    CREATE TABLE IF NOT EXISTS SimulationRuns (
+        run_id INTEGER PRIMARY KEY,
+        created TEXT,
+        first_step INTEGER,
+        last_step INTEGER
+    )
+    """)
+    connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS SimulationRollup (
+        run_id INTEGER NOT NULL,
+        resolution INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        {", ".join(f"{column} INTEGER" for column in ROLLUP_COLUMNS.split(", "))},
+        PRIMARY KEY (run_id, resolution, bucket)
+    ) WITHOUT ROWID
+    """)
+    if legacy:
+        # Den gamla loggen blir körning 0
+        connection.execute("""
+        INSERT INTO SimulationLog (run_id, step, workers, food, products)
+        SELECT 0, step, workers, food, products FROM SimulationLogLegacy
+        """)
+        connection.execute("DROP TABLE SimulationLogLegacy")
+        first, last = connection.execute("SELECT MIN(step), MAX(step) FROM SimulationLog WHERE run_id = 0").fetchone()
+        connection.execute("INSERT OR REPLACE INTO SimulationRuns VALUES (0, ?, ?, ?)",
+                           (time.strftime("%Y-%m-%dT%H:%M:%S"), first, last))
+        if first is not None:
+            update_rollups(connection, 0, first, last)
+
+# Funktion: update_rollups - Räknar om rollup-hinkarna som täcker stegen first..last för en körning
+# Varje nivå byggs av nivån under (rå loggen för den finaste), så kostnaden följer antalet ändrade rader och inte hinkstorleken
+def update_rollups(connection, run_id, first, last):
+    previous = None
+    for resolution in ROLLUP_RESOLUTIONS:
+        low, high = first // resolution, last // resolution
+        if previous is None:
+            connection.execute(f"""
+            INSERT OR REPLACE INTO SimulationRollup (run_id, resolution, bucket, {ROLLUP_COLUMNS})
+            SELECT run_id, ?, step / ?, {ROLLUP_FROM_LOG} FROM SimulationLog
+            WHERE run_id = ? AND step >= ? AND step < ?
+            GROUP BY step / ?
+            """, (resolution, resolution, run_id, low * resolution, (high + 1) * resolution, resolution))
+        else:
+            factor = resolution // previous
+            connection.execute(f"""
+            INSERT OR REPLACE INTO SimulationRollup (run_id, resolution, bucket, {ROLLUP_COLUMNS})
+            SELECT run_id, ?, bucket / ?, {ROLLUP_FROM_ROLLUP} FROM SimulationRollup
+            WHERE run_id = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+            GROUP BY bucket / ?
+            """, (resolution, factor, run_id, previous, low * factor, (high + 1) * factor, factor))
+        previous = resolution
+
+# Klass: SimulationLogger - Buffrar stegrader och skriver dem i batchar till SQLite
+class SimulationLogger:
+    # Konstruktor: Öppnar databasen och ställer in journal-läge och synkronisering
+    # run_id skiljer körningar åt i samma databas; None tilldelar ett nytt id i init_schema
+    def __init__(self, db_path="SIMSIMDATABASE.db", batch_size=100, flush_interval_ms=1000,
+                 journal_mode="WAL", synchronous="NORMAL", run_id=0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.run_id = run_id
+        self.connection = sqlite3.connect(db_path)
+        if journal_mode:
+            self.connection.execute(f"PRAGMA journal_mode={journal_mode}")
+        if synchronous:
+            self.connection.execute(f"PRAGMA synchronous={synchronous}")
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    # Funktion: init_schema - Skapar tabellerna om de saknas, registrerar körningen och tömmer den vid reset (idempotent)
+    def init_schema(self, reset=True):
+        with self.connection:
+            create_log_schema(self.connection)
+            if self.run_id is None:
+                cursor = self.connection.execute("INSERT INTO SimulationRuns (created) VALUES (?)",
+                                                 (time.strftime("%Y-%m-%dT%H:%M:%S"),))
+                self.run_id = cursor.lastrowid
             else:
-                print("No worker available in Foodcourt.produce")
+                self.connection.execute("INSERT OR IGNORE INTO SimulationRuns (run_id, created) VALUES (?, ?)",
+                                        (self.run_id, time.strftime("%Y-%m-%dT%H:%M:%S")))
+            if reset:
+                self.connection.execute("DELETE FROM SimulationLog WHERE run_id = ?", (self.run_id,))
+                self.connection.execute("DELETE FROM SimulationRollup WHERE run_id = ?", (self.run_id,))
+                self.connection.execute("UPDATE SimulationRuns SET first_step = NULL, last_step = NULL "
+                                        "WHERE run_id = ?", (self.run_id,))
+
+    # Funktion: log - Lägger en stegrad i bufferten och tömmer den var N:e steg eller var T:e millisekund
+    def log(self, step, workers, food, products):
+        self.buffer.append((self.run_id, step, workers, food, products))
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Funktion: flush - Skriver alla buffrade rader med en UPSERT och uppdaterar rollups i samma transaktion
+    def flush(self):
+        if self.buffer:
+            run_id = self.run_id
+            first = min(row[1] for row in self.buffer)
+            last = max(row[1] for row in self.buffer)
+            with self.connection:
+                self.connection.executemany("""
+                INSERT INTO SimulationLog (run_id, step, workers, food, products)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(run_id, step) DO UPDATE SET
+                    workers = excluded.workers,
+                    food = excluded.food,
+                    products = excluded.products
+                """, self.buffer)
+                update_rollups(self.connection, run_id, first, last)
+                self.connection.execute("""
+                UPDATE SimulationRuns SET
+                    first_step = MIN(COALESCE(first_step, ?), ?),
+                    last_step = MAX(COALESCE(last_step, ?), ?)
+                WHERE run_id = ?
+                """, (first, first, last, last, run_id))
+            self.buffer.clear()
+        self.last_flush = time.monotonic()
+
+    # Funktion: close - Tömmer bufferten och stänger anslutningen
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# Klass: LogWriterError - Fel från loggens skrivartråd; simulationsloopen låter det passera i stället för att köra om steget
+class LogWriterError(RuntimeError):
+    pass
+
+# Klass: AsyncLogger - Lägger stegrader i en begränsad kö; en egen skrivartråd äger SQLite-anslutningen och skriver dem
+class AsyncLogger:
+    # Konstruktor: Startar skrivartråden; backpressure är "block" (vänta på plats i kön) eller "drop" (släng och räkna raden)
+    def __init__(self, db_path="SIMSIMDATABASE.db", queue_size=10_000, backpressure="block", **logger_options):
+        if backpressure not in ("block", "drop"):
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+        self.db_path = db_path
+        self.run_id = logger_options.get("run_id", 0)
+        self.backpressure = backpressure
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.error = None
+        self.closed = False
+        self._ready = threading.Event()
+        self.thread = threading.Thread(target=self._writer, args=(db_path, logger_options),
+                                       name="simsim-log-writer", daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        self._raise_error()
+
+    # Funktion: _writer - Skrivartråden: öppnar loggen och skriver rader tills den får stoppsignalen
+    def _writer(self, db_path, logger_options):
+        try:
+            logger = SimulationLogger(db_path, **logger_options)
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+            return
+        self._sink = logger
+        self._ready.set()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                if len(item) == 3:
+                    # Kontrollmeddelande (metodnamn, argument, Event) från simulationstråden
+                    name, args, done = item
+                    try:
+                        getattr(logger, name)(*args)
+                    except Exception as e:
+                        self.error = e
+                    done.set()
+                else:
+                    logger.log(*item)
+        except Exception as e:
+            self.error = e
+            # Töm kön så att en blockerad producent inte hänger kvar
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None and len(item) == 3:
+                    item[2].set()
+        finally:
+            try:
+                logger.close()
+            except Exception as e:
+                self.error = self.error or e
+
+    # Funktion: _raise_error - Lyfter ett fel från skrivartråden i simulationstråden
+    # Felet ligger kvar, så att varje senare log, flush och close också misslyckas i stället för att tyst tappa rader
+    def _raise_error(self):
+        if self.error is not None:
+            raise LogWriterError(f"Log writer failed: {self.error}") from self.error
+
+    # Funktion: _put - Lägger ett element i kön enligt back-pressure-policyn; True om det kom med
+    def _put(self, item, force=False):
+        if self.backpressure == "drop" and not force:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                return False
+        while True:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if not self.thread.is_alive():
+                    self._raise_error()
+                    raise LogWriterError("Log writer stopped")
+
+    # Funktion: _call - Kör en metod på loggen i skrivartråden och väntar tills den är klar
+    def _call(self, name, *args):
+        self._raise_error()
+        done = threading.Event()
+        self._put((name, args, done), force=True)
+        while not done.wait(0.1):
+            if not self.thread.is_alive():
+                break
+        self._raise_error()
+
+    # Funktion: init_schema - Sätter upp schemat i skrivartråden och hämtar körningens (ev. nytilldelade) run_id
+    def init_schema(self, reset=True):
+        self._call("init_schema", reset)
+        self.run_id = self._sink.run_id
+
+    # Funktion: log - Lägger en kompakt stegrad i kön
+    def log(self, step, workers, food, products):
+        self._raise_error()
+        if not self.thread.is_alive():
+            raise LogWriterError("Log writer stopped")
+        self._put((step, workers, food, products))
+
+    # Funktion: flush - Väntar tills allt i kön är skrivet och committat
+    def flush(self):
+        self._call("flush")
+
+    # Funktion: close - Tömmer kön, stänger anslutningen och väntar in skrivartråden
+    def close(self):
+        if self.closed:
+            self._raise_error()
+            return
+        self.closed = True
+        if self.thread.is_alive():
+            self._put(None, force=True)
+        self.thread.join()
+        if self.dropped:
+            report(f"Log writer dropped {self.dropped} rows under back-pressure", 1)
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# Klass: MemoryLogger - Samlar stegrader i minnet i stället för i en databas (t.ex. för replikor)
+class MemoryLogger:
+    # Konstruktor: Initierar en tom lista med rader
+    def __init__(self):
+        self.rows = []
+        self.run_id = 0
+
+    # Funktion: init_schema - Tömmer raderna vid reset
+    def init_schema(self, reset=True):
+        if reset:
+            self.rows.clear()
+
+    # Funktion: log - Sparar en stegrad
+    def log(self, step, workers, food, products):
+        self.rows.append((step, workers, food, products))
+
+    # Funktion: flush - Inget att skriva för en minneslogg
+    def flush(self):
+        pass
+
+    # Funktion: close - Inget att stänga för en minneslogg
+    def close(self):
+        pass
+
+# Klass: Instrumentation - Räknare, log2-histogram och en TransitionLog per steg, sparade bredvid SimulationLog
+# Tider mäts i nanosekunder; histogramhink b innehåller tider t med 2**(b-1) <= t < 2**b
+class Instrumentation:
+    HISTOGRAM_BUCKETS = 65
+
+    # Konstruktor: Med db_path=None hålls allt i minnet; transition_log=False sparar bara räknare och histogram
+    # run_id märker alla rader med körningen (main sätter den till loggens run_id innan schemat sätts upp)
+    def __init__(self, db_path=None, transition_log=True, batch_size=10_000, run_id=0):
+        self.db_path = db_path
+        self.run_id = run_id
+        self.transition_log = transition_log
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(db_path, timeout=30) if db_path else None
+        self.outcomes = {}
+        self.phases = {}
+        self.histograms = {}
+        self.transitions = []
+        self.pending = []
+
+    # Tabellerna och deras kolumner efter run_id, med primärnyckel där raderna räknas upp vid close
+    TABLES = (
+        ("TransitionLog", "step INTEGER, transition INTEGER, building TEXT, outcome TEXT, duration_ns INTEGER", None),
+        ("TransitionOutcomes", "building TEXT, outcome TEXT, count INTEGER", "run_id, building, outcome"),
+        ("PhaseTimings", "phase TEXT, count INTEGER, total_ns INTEGER", "run_id, phase"),
+        ("PhaseHistogram", "phase TEXT, bucket INTEGER, count INTEGER", "run_id, phase, bucket"),
+    )
+
+    # Funktion: init_schema - Skapar tabellerna om de saknas och tömmer körningens rader vid reset (idempotent)
+    def init_schema(self, reset=True):
+        if reset:
+            self.outcomes.clear()
+            self.phases.clear()
+            self.histograms.clear()
+            self.transitions.clear()
+            self.pending.clear()
+        if self.connection is None:
+            return
+        with self.connection:
+            for table, columns, key in self.TABLES:
+                primary_key = f", PRIMARY KEY ({key})" if key else ""
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (run_id INTEGER NOT NULL, "
+                                        f"{columns}{primary_key})")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS TransitionLogRunStep ON TransitionLog (run_id, step)")
+            if reset:
+                for table, _, _ in self.TABLES:
+                    self.connection.execute(f"DELETE FROM {table} WHERE run_id = ?", (self.run_id,))
+
+    # Funktion: record_phase - Lägger en tidsmätning i fasens räknare och histogram
+    def record_phase(self, phase, duration_ns):
+        timing = self.phases.get(phase)
+        if timing is None:
+            timing = self.phases[phase] = [0, 0]
+            self.histograms[phase] = [0] * self.HISTOGRAM_BUCKETS
+        timing[0] += 1
+        timing[1] += duration_ns
+        self.histograms[phase][min(duration_ns.bit_length(), self.HISTOGRAM_BUCKETS - 1)] += 1
+
+    # Funktion: record_transition - Räknar en övergångs utfall och tid och lägger en rad i TransitionLog
+    def record_transition(self, step, index, building, outcome, duration_ns):
+        key = (building, outcome)
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+        self.record_phase(f"produce:{building}", duration_ns)
+        if self.transition_log:
+            self.pending.append((self.run_id, step, index, building, outcome, duration_ns))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    # Funktion: flush - Skriver väntande TransitionLog-rader (eller sparar dem i minnet utan databas)
+    def flush(self):
+        if not self.pending:
+            return
+        if self.connection is None:
+            self.transitions.extend(self.pending)
         else:
-            return None
+            with self.connection:
+                self.connection.executemany("""
+                INSERT INTO TransitionLog (run_id, step, transition, building, outcome, duration_ns)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """, self.pending)
+        self.pending.clear()
+
+    # Funktion: summary - Returnerar utfall per byggnad och tid per fas som en JSON-vänlig dict
+    def summary(self):
+        outcomes = {}
+        for (building, outcome), count in sorted(self.outcomes.items()):
+            outcomes.setdefault(building, {})[outcome] = count
+        phases = {phase: {"count": count, "total_ns": total, "mean_ns": total / count}
+                  for phase, (count, total) in sorted(self.phases.items())}
+        return {"outcomes": outcomes, "phases": phases}
+
+    # Funktion: close - Skriver kvarvarande rader samt räknare och histogram, och stänger anslutningen
+    # Räknarna läggs till körningens befintliga värden, så att en fortsatt körning (utan reset) summeras
+    def close(self):
+        self.flush()
+        if self.connection is None:
+            return
+        run_id = self.run_id
+        try:
+            with self.connection:
+                self.connection.executemany("""
+                INSERT INTO TransitionOutcomes (run_id, building, outcome, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(run_id, building, outcome) DO UPDATE SET count = count + excluded.count
+                """, [(run_id, building, outcome, count) for (building, outcome), count in self.outcomes.items()])
+                self.connection.executemany("""
+                INSERT INTO PhaseTimings (run_id, phase, count, total_ns) VALUES (?, ?, ?, ?)
+                ON CONFLICT(run_id, phase) DO UPDATE SET
+                    count = count + excluded.count,
+                    total_ns = total_ns + excluded.total_ns
+                """, [(run_id, phase, count, total) for phase, (count, total) in self.phases.items()])
+                self.connection.executemany("""
+                INSERT INTO PhaseHistogram (run_id, phase, bucket, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(run_id, phase, bucket) DO UPDATE SET count = count + excluded.count
+                """, [(run_id, phase, bucket, count) for phase, buckets in self.histograms.items()
+                      for bucket, count in enumerate(buckets) if count])
+        finally:
+            self.connection.close()
+            self.connection = None
+
+# Kolumnerna i SimulationLog och Excels radgräns (1 048 576 rader inklusive rubrikraden)
+LOG_COLUMNS = ("step", "workers", "food", "products")
+EXCEL_MAX_ROWS = 1_048_575
+
+# Funktion: iter_simulation_log - Läser en körnings rader ur SimulationLog i bitar med en cursor så att minnet hålls begränsat
+def iter_simulation_log(db_path, chunk_size=50_000, run_id=0):
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(LOG_COLUMNS)} FROM SimulationLog WHERE run_id = ? ORDER BY step",
+                              (run_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+# Funktion: export_simulation_log - Strömmar en körning ur SimulationLog till CSV, Parquet, Arrow eller (små körningar) Excel
+def export_simulation_log(db_path, out_path, format=None, chunk_size=50_000, run_id=0):
+    if format is None:
+        extension = os.path.splitext(out_path)[1].lower()
+        format = {".csv": "csv", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow",
+                  ".ipc": "arrow", ".xlsx": "xlsx"}.get(extension)
+    if format not in ("csv", "parquet", "arrow", "xlsx"):
+        raise ValueError(f"Unknown export format for {out_path!r}: {format}")
+
+    rows_written = 0
+    if format == "csv":
+        import csv
+        with open(out_path, "w", newline="") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(LOG_COLUMNS)
+            for rows in iter_simulation_log(db_path, chunk_size, run_id):
+                writer.writerows(rows)
+                rows_written += len(rows)
+    elif format in ("parquet", "arrow"):
+        import pyarrow as pa
+        schema = pa.schema([(column, pa.int64()) for column in LOG_COLUMNS])
+        if format == "parquet":
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(out_path, schema)
+        else:
+            writer = pa.ipc.new_file(out_path, schema)
+        with writer:
+            for rows in iter_simulation_log(db_path, chunk_size, run_id):
+                columns = [pa.array(values, pa.int64()) for values in zip(*rows)]
+                batch = pa.RecordBatch.from_arrays(columns, schema=schema)
+                if format == "parquet":
+                    writer.write_batch(batch)
+                else:
+                    writer.write(batch)
+                rows_written += len(rows)
+    else:
+        conn = sqlite3.connect(db_path)
+        try:
+            total = conn.execute("SELECT COUNT(*) FROM SimulationLog WHERE run_id = ?", (run_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        if total > EXCEL_MAX_ROWS:
+            raise ValueError(f"SimulationLog has {total} rows, more than Excel's limit of {EXCEL_MAX_ROWS}; "
+                             "export to CSV, Parquet or Arrow instead")
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("SimulationLog")
+        sheet.append(LOG_COLUMNS)
+        for rows in iter_simulation_log(db_path, chunk_size, run_id):
+            for row in rows:
+                sheet.append(row)
+            rows_written += len(rows)
+        workbook.save(out_path)
+    return rows_written
+
+# Klass: SimulationQuery - Intervall- och aggregatfrågor över SimulationLog som använder rollup-tabellen där det går
+class SimulationQuery:
+    # Konstruktor: Öppnar databasen för läsning
+    def __init__(self, db_path="SIMSIMDATABASE.db"):
+        self.connection = sqlite3.connect(db_path)
+
+    # Funktion: runs - Returnerar alla körningar med första och sista loggade steg
+    def runs(self):
+        return [{"run_id": run_id, "created": created, "first_step": first, "last_step": last}
+                for run_id, created, first, last in self.connection.execute(
+                    "SELECT run_id, created, first_step, last_step FROM SimulationRuns ORDER BY run_id")]
+
+    # Funktion: _run_filter - SQL-villkor och parametrar för run_id som ett id, en lista med id eller None (alla)
+    def _run_filter(self, run_id):
+        if run_id is None:
+            return "1", ()
+        if isinstance(run_id, int):
+            return "run_id = ?", (run_id,)
+        run_ids = tuple(run_id)
+        return f"run_id IN ({', '.join('?' * len(run_ids))})", run_ids
+
+    # Funktion: _bounds - Fyller i start och stop (exklusivt) från SimulationRuns när de saknas
+    def _bounds(self, run_id, start, stop):
+        if start is None or stop is None:
+            condition, parameters = self._run_filter(run_id)
+            first, last = self.connection.execute(
+                f"SELECT MIN(first_step), MAX(last_step) FROM SimulationRuns WHERE {condition}", parameters).fetchone()
+            start = first if start is None else start
+            stop = (last + 1 if last is not None else None) if stop is None else stop
+        return start, stop
+
+    # Funktion: range - Returnerar råa rader (run_id, step, workers, food, products) för steg start <= step < stop
+    def range(self, run_id=0, start=None, stop=None):
+        start, stop = self._bounds(run_id, start, stop)
+        if start is None:
+            return []
+        condition, parameters = self._run_filter(run_id)
+        return self.connection.execute(f"""
+        SELECT run_id, step, workers, food, products FROM SimulationLog
+        WHERE {condition} AND step >= ? AND step < ? ORDER BY run_id, step
+        """, (*parameters, start, stop)).fetchall()
+
+    # Funktion: window_for - Minsta fönster som ger högst points fönster över intervallet, avrundat uppåt till en rollup-upplösning
+    def window_for(self, points, run_id=0, start=None, stop=None):
+        start, stop = self._bounds(run_id, start, stop)
+        if start is None:
+            return 1
+        window = max(1, -(-(stop - start) // max(1, points)))
+        resolution = max([1] + [r for r in ROLLUP_RESOLUTIONS if r <= window])
+        return -(-window // resolution) * resolution
+
+    # Funktion: aggregate - Min, max och medel per resurs i fönster om window steg (justerade till multipler av window)
+    # Inre delar av intervallet läses från den grövsta rollup-nivån som delar window, kanterna från finare nivåer,
+    # så att kostnaden följer antalet fönster och inte antalet råa rader
+    def aggregate(self, run_id=0, start=None, stop=None, window=1000):
+        start, stop = self._bounds(run_id, start, stop)
+        if start is None or start >= stop:
+            return []
+        levels = sorted((r for r in ROLLUP_RESOLUTIONS if window % r == 0), reverse=True)
+        pieces = []
+        self._split(start, stop, levels, pieces)
+
+        condition, parameters = self._run_filter(run_id)
+        windows = {}
+        for resolution, low, high in pieces:
+            if resolution == 1:
+                rows = self.connection.execute(f"""
+                SELECT step / ?, {ROLLUP_FROM_LOG} FROM SimulationLog
+                WHERE {condition} AND step >= ? AND step < ? GROUP BY step / ?
+                """, (window, *parameters, low, high, window))
+            else:
+                rows = self.connection.execute(f"""
+                SELECT bucket * ? / ?, {ROLLUP_FROM_ROLLUP} FROM SimulationRollup
+                WHERE {condition} AND resolution = ? AND bucket >= ? AND bucket < ? GROUP BY bucket * ? / ?
+                """, (resolution, window, *parameters, resolution, low // resolution, high // resolution,
+                      resolution, window))
+            for index, count, *values in rows:
+                current = windows.get(index)
+                if current is None:
+                    windows[index] = [count, *values]
+                    continue
+                current[0] += count
+                for position in range(0, len(values), 3):
+                    current[1 + position] = min(current[1 + position], values[position])
+                    current[2 + position] = max(current[2 + position], values[position + 1])
+                    current[3 + position] += values[position + 2]
+
+        result = []
+        for index in sorted(windows):
+            count, *values = windows[index]
+            row = {"step": index * window, "count": count}
+            for position, res in enumerate(RESOURCES):
+                low, high, total = values[3 * position:3 * position + 3]
+                row[f"{res}_min"] = low
+                row[f"{res}_max"] = high
+                row[f"{res}_mean"] = total / count
+            result.append(row)
+        return result
+
+    # Funktion: _split - Delar [low, high) i bitar (upplösning, från, till) med hela hinkar på grövsta möjliga nivå
+    def _split(self, low, high, levels, pieces):
+        if low >= high:
+            return
+        if not levels:
+            pieces.append((1, low, high))
+            return
+        resolution = levels[0]
+        first = -(-low // resolution) * resolution
+        last = high // resolution * resolution
+        if first < last:
+            pieces.append((resolution, first, last))
+            self._split(low, first, levels[1:], pieces)
+            self._split(last, high, levels[1:], pieces)
+        else:
+            self._split(low, high, levels[1:], pieces)
+
+    # Funktion: close - Stänger anslutningen
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# Serierna som plottas: (kolumn, etikett, färg)
+PLOT_SERIES = (("workers", "Workers", "blue"), ("food", "Food", "green"), ("products", "Products", "red"))
+
+# Klass: MinMaxDownsampler - Strömmande nedsampling som behåller min och max per hink så att kurvans form bevaras
+class MinMaxDownsampler:
+    # Konstruktor: max_points är ungefärligt antal punkter per serie i resultatet (två per hink)
+    def __init__(self, max_points=2000, series=RESOURCES):
+        self.max_buckets = max(1, max_points // 2)
+        self.series = tuple(series)
+        self.width = 1
+        self.buckets = []
+
+    # Funktion: add - Lägger till en observation; hinkarna slås ihop parvis och bredden dubblas när de blir för många
+    def add(self, step, values):
+        index = step // self.width
+        if self.buckets and self.buckets[-1][0] == index:
+            bucket = self.buckets[-1][1]
+            for position, value in enumerate(values):
+                low, high = bucket[position]
+                if value < low[1]:
+                    bucket[position][0] = (step, value)
+                if value > high[1]:
+                    bucket[position][1] = (step, value)
+        else:
+            self.buckets.append((index, [[(step, value), (step, value)] for value in values]))
+            if len(self.buckets) > self.max_buckets:
+                self._merge()
+
+    # Funktion: _merge - Dubblar hinkbredden och slår ihop hinkar som hamnar i samma nya hink
+    def _merge(self):
+        self.width *= 2
+        merged = []
+        for index, bucket in self.buckets:
+            index //= 2
+            if merged and merged[-1][0] == index:
+                target = merged[-1][1]
+                for position, (low, high) in enumerate(bucket):
+                    if low[1] < target[position][0][1]:
+                        target[position][0] = low
+                    if high[1] > target[position][1][1]:
+                        target[position][1] = high
+            else:
+                merged.append((index, [list(pair) for pair in bucket]))
+        self.buckets = merged
+
+    # Funktion: points - Returnerar {serie: (steg, värden)} med min och max per hink i stegordning
+    def points(self):
+        result = {}
+        for position, name in enumerate(self.series):
+            steps, values = [], []
+            for _, bucket in self.buckets:
+                low, high = bucket[position]
+                for step, value in sorted({low, high}):
+                    steps.append(step)
+                    values.append(value)
+            result[name] = (steps, values)
+        return result
+
+# Funktion: render_simulation_plot - Ritar serierna med Agg direkt till en PNG/SVG-fil utan pyplot eller fönster
+def render_simulation_plot(points, output_path):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for name, label, color in PLOT_SERIES:
+        steps, values = points.get(name, ([], []))
+        axes.plot(steps, values, label=label, color=color)
+    axes.set_xlabel('Simulation Step')
+    axes.set_ylabel('Quantity')
+    axes.set_title('Simulation Data Over Time')
+    axes.legend()
+    axes.grid(True)
+    # Skriv till en temporär fil först så att en läsare aldrig ser en halvskriven bild
+    root, extension = os.path.splitext(output_path)
+    temporary_path = f"{root}.tmp{extension}"
+    figure.savefig(temporary_path)
+    os.replace(temporary_path, output_path)
+
+# Funktion: plot_simulation_log - Plottar en körning från databasen, nedsamplad till max_points per serie
+# Med output_path skrivs en PNG/SVG-fil headless (Agg), annars visas ett blockerande fönster som tidigare
+def plot_simulation_log(db_path, output_path=None, max_points=2000, run_id=0):
+    # Min och max per fönster läses ur rollup-tabellen, så kostnaden följer max_points och inte loggens längd
+    with SimulationQuery(db_path) as query:
+        window = query.window_for(max(1, max_points // 2), run_id)
+        windows = query.aggregate(run_id, window=window)
+    points = {}
+    for name, _, _ in PLOT_SERIES:
+        steps, values = [], []
+        for row in windows:
+            steps.append(row["step"])
+            values.append(row[f"{name}_min"])
+            if window > 1:
+                steps.append(row["step"])
+                values.append(row[f"{name}_max"])
+        points[name] = (steps, values)
+    if output_path:
+        render_simulation_plot(points, output_path)
+        return
+    # Tunga beroenden laddas först när de behövs, så att import av simsim går snabbt
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(10, 6))
+    for name, label, color in PLOT_SERIES:
+        plt.plot(*points[name], label=label, color=color)
+    plt.xlabel('Simulation Step')
+    plt.ylabel('Quantity')
+    plt.title('Simulation Data Over Time')
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+# Klass: LivePlot - Uppdaterar en bildfil var N:e steg; ritningen sker i en bakgrundstråd så att loopen inte stannar
+class LivePlot:
+    # Konstruktor: Initierar nedsamplingen och ritartråden
+    def __init__(self, output_path, interval=1000, max_points=2000):
+        self.output_path = output_path
+        self.interval = interval
+        self.downsampler = MinMaxDownsampler(max_points)
+        self.next_render = interval
+        self.pending = None
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._render_loop, name="simsim-live-plot", daemon=True)
+        self.thread.start()
+
+    # Funktion: update - Matar in ett steg; var interval:e steg lämnas en ögonblicksbild till ritartråden
+    def update(self, step, workers, food, products):
+        self.downsampler.add(step, (workers, food, products))
+        if step >= self.next_render:
+            self.next_render = step + self.interval
+            self._submit()
+
+    # Funktion: _submit - Ersätter en eventuell väntande bild, så att en långsam ritning aldrig köar upp arbete
+    def _submit(self):
+        with self.condition:
+            self.pending = self.downsampler.points()
+            self.condition.notify()
+
+    # Funktion: _render_loop - Ritartråden: väntar på ögonblicksbilder och skriver dem till fil
+    def _render_loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                points, self.pending = self.pending, None
+                if points is None:
+                    return
+            try:
+                render_simulation_plot(points, self.output_path)
+            except Exception as e:
+                report(f"Live plot failed: {e}", 1)
+
+    # Funktion: close - Ritar en sista bild och väntar in tråden
+    def close(self):
+        self._submit()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+# Funktion: _normalize_numbers - Gör heltaliga flyttal och bool till int, så att lika tal serialiseras lika
+def _normalize_numbers(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {key: _normalize_numbers(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_numbers(item) for item in value]
+    return value
+
+# Klass: SimulationConfig - Samlar alla justerbara parametrar och byggnadskopplingen för en koloni
+class SimulationConfig:
+    # Byggnadskopplingen anges som index: (barrack_in, barrack_out, förråd/lada)
+    FIELDS = (
+        "workers_per_barrack", "products_per_storage", "food_per_shed",
+        "balance_margin", "stagnation_threshold", "stagnation_delta",
+        "new_workers", "new_worker_vitality", "new_food", "new_food_quality",
+        "new_products", "new_product_quality",
+        "remove_workers_share", "remove_food_share", "remove_products_share",
+        "barracks", "storages", "sheds", "factories", "homes", "farms", "foodcourts",
+        "scheduler", "firings_per_tick", "priority_boost", "transition_rates", "transition_durations",
+    )
+
+    # Konstruktor: Initierar konfigurationen med standardvärdena från den ursprungliga kolonin
+    def __init__(self, workers_per_barrack=100, products_per_storage=200, food_per_shed=100,
+                 balance_margin=0.8, stagnation_threshold=15, stagnation_delta=5,
+                 new_workers=(10, 30), new_worker_vitality=(50, 100), new_food=(20, 40), new_food_quality=(1, 2),
+                 new_products=(15, 35), new_product_quality=(1, 3),
+                 remove_workers_share=0.3, remove_food_share=0.2, remove_products_share=0.2,
+                 barracks=2, storages=1, sheds=2,
+                 factories=((0, 1, 0), (0, 1, 0)),
+                 homes=((1, 0, 0), (0, 1, 0), (0, 0, 0), (1, 1, 0)),
+                 farms=((0, 0, 0), (1, 1, 0)),
+                 foodcourts=((0, 0, 0), (0, 1, 0), (1, 0, 0)),
+                 scheduler="random", firings_per_tick=4, priority_boost=2.0,
+                 transition_rates=None, transition_durations=None):
+        self.workers_per_barrack = workers_per_barrack
+        self.products_per_storage = products_per_storage
+        self.food_per_shed = food_per_shed
+        self.balance_margin = balance_margin
+        self.stagnation_threshold = stagnation_threshold
+        self.stagnation_delta = stagnation_delta
+        self.new_workers = tuple(new_workers)
+        self.new_worker_vitality = tuple(new_worker_vitality)
+        self.new_food = tuple(new_food)
+        self.new_food_quality = tuple(new_food_quality)
+        self.new_products = tuple(new_products)
+        self.new_product_quality = tuple(new_product_quality)
+        self.remove_workers_share = remove_workers_share
+        self.remove_food_share = remove_food_share
+        self.remove_products_share = remove_products_share
+        self.barracks = barracks
+        self.storages = storages
+        self.sheds = sheds
+        self.factories = tuple(tuple(wiring) for wiring in factories)
+        self.homes = tuple(tuple(wiring) for wiring in homes)
+        self.farms = tuple(tuple(wiring) for wiring in farms)
+        self.foodcourts = tuple(tuple(wiring) for wiring in foodcourts)
+        # Schemaläggning: "random" (en byggnad per tick), "weighted" eller "event"; takt/varaktighet per byggnadstyp
+        self.scheduler = scheduler
+        self.firings_per_tick = firings_per_tick
+        self.priority_boost = priority_boost
+        self.transition_rates = dict(transition_rates or {})
+        self.transition_durations = dict(transition_durations or {})
+
+    # Funktion: to_dict - Returnerar konfigurationen som en JSON-vänlig dict
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    # Funktion: from_dict - Skapar en konfiguration från en dict (t.ex. inläst JSON)
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    # Funktion: replace - Returnerar en kopia med några parametrar ändrade
+    def replace(self, **changes):
+        values = self.to_dict()
+        values.update(changes)
+        return SimulationConfig.from_dict(values)
+
+    # Funktion: canonical - Konfigurationen som JSON med sorterade nycklar och normaliserade tal (1.0 skrivs som 1)
+    # Likhet, hash och cachenyckel bygger alla på den här formen, så att 1 och 1.0 ger samma konfiguration
+    def canonical(self):
+        return json.dumps(_normalize_numbers(self.to_dict()), sort_keys=True)
+
+    # Funktion: key - Stabil hash av (konfiguration, seed, extra) som används som cachenyckel
+    def key(self, seed, **extra):
+        payload = json.dumps({"config": json.loads(self.canonical()), "seed": seed, **_normalize_numbers(extra)},
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __eq__(self, other):
+        return isinstance(other, SimulationConfig) and self.canonical() == other.canonical()
+
+    def __hash__(self):
+        return hash(self.canonical())
+
+    def __repr__(self):
+        changed = {field: value for field, value in self.to_dict().items()
+                   if value != getattr(DEFAULT_CONFIG, field)}
+        return f"SimulationConfig({', '.join(f'{k}={v!r}' for k, v in changed.items())})"
+
+DEFAULT_CONFIG = SimulationConfig()
+
+# Ögonblicksbilder: magiska bytes + längden på en JSON-rubrik, följt av rubriken och rå array-data i rubrikens ordning
+SNAPSHOT_MAGIC = b"SIMSNAP1"
+SNAPSHOT_PREFIX = struct.Struct("<8sI")
+
+# Funktion: pack_snapshot - Packar en rubrik (dict) och namngivna arrayer till bytes
+def pack_snapshot(header, arrays):
+    header = dict(header, byteorder=sys.byteorder,
+                  arrays=[[name, values.typecode, len(values)] for name, values in arrays])
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    parts = [SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, len(encoded)), encoded]
+    parts.extend(values.tobytes() for _, values in arrays)
+    return b"".join(parts)
+
+# Funktion: unpack_snapshot - Packar upp bytes från pack_snapshot till (rubrik, {namn: array})
+def unpack_snapshot(data):
+    magic, length = SNAPSHOT_PREFIX.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a simsim snapshot")
+    offset = SNAPSHOT_PREFIX.size
+    header = json.loads(bytes(data[offset:offset + length]).decode("utf-8"))
+    offset += length
+    arrays = {}
+    for name, typecode, count in header["arrays"]:
+        values = array(typecode)
+        size = values.itemsize * count
+        values.frombytes(data[offset:offset + size])
+        if header["byteorder"] != sys.byteorder:
+            values.byteswap()
+        arrays[name] = values
+        offset += size
+    return header, arrays
 
 # Klass: main - Huvudklassen för att köra simulationen
 class main():
     # Konstruktor: Initierar alla byggnader, resurser och databasanslutning
-    def __init__(self):
-        self.barracks = [Barrack(), Barrack()]  # Två barracker
-        self.storages = [Storage()]             # Ett förråd
-        self.sheds = [Shed(), Shed()]            # Två lador
-        self.factories = [
-            Factory(self.barracks[0], self.barracks[1], self.storages[0]),
-            Factory(self.barracks[0], self.barracks[1], self.storages[0])
-        ]
-        self.homes = [
-            Home(self.barracks[1], self.barracks[0], self.storages[0], self),
-            Home(self.barracks[0], self.barracks[1], self.storages[0], self),
-            Home(self.barracks[0], self.barracks[0], self.storages[0], self),
-            Home(self.barracks[1], self.barracks[1], self.storages[0], self)
-        ]
-        self.farms = [
-            Farm(self.barracks[0], self.barracks[0], self.sheds[0]),
-            Farm(self.barracks[1], self.barracks[1], self.sheds[0])
-        ]
-        self.foodcourts = [
-            Foodcourt(self.barracks[0], self.barracks[0], self.sheds[0]),
-            Foodcourt(self.barracks[0], self.barracks[1], self.sheds[0]),
-            Foodcourt(self.barracks[1], self.barracks[0], self.sheds[0])
-        ]
+    def __init__(self, db_path="SIMSIMDATABASE.db", log_batch_size=100, log_flush_interval_ms=1000,
+                 journal_mode="WAL", synchronous="NORMAL", columnar_workers=False,
+                 counted_inventory=False, seed=None, logger=None, config=None, reset_log=False,
+                 async_logging=False, log_queue_size=10_000, log_backpressure="block", instrumentation=None,
+                 run_id=None):
+        self.config = config if config is not None else SimulationConfig()
+        # Egen slumpgenerator per simulation när seed anges, annars den globala random-modulen
+        self.rng = random.Random(seed) if seed is not None else random
+        # Kolumnbaserad population delas av alla barracker när columnar_workers är satt
+        self.columnar_workers = columnar_workers
+        self.counted_inventory = counted_inventory
+        self.population = WorkerPopulation() if columnar_workers else None
+        # Löpande summor och id-utdelning så att räkning och nya id kostar O(1)
+        self.counters = ResourceCounters()
+        self.ids = IdAllocator()
+        # Barracker, förråd och lador enligt konfigurationen (standard: två barracker, ett förråd, två lador)
+        self.barracks = [Barrack(self.population, self.counters) for _ in range(self.config.barracks)]
+        self.storages = [Storage(counted_inventory, self.counters) for _ in range(self.config.storages)]
+        self.sheds = [Shed(counted_inventory, self.counters) for _ in range(self.config.sheds)]
+        self.factories = [Factory(self.barracks[b_in], self.barracks[b_out], self.storages[st], rng=self.rng)
+                          for b_in, b_out, st in self.config.factories]
+        self.homes = [Home(self.barracks[b_in], self.barracks[b_out], self.storages[st], self, rng=self.rng)
+                      for b_in, b_out, st in self.config.homes]
+        self.farms = [Farm(self.barracks[b_in], self.barracks[b_out], self.sheds[sh], rng=self.rng)
+                      for b_in, b_out, sh in self.config.farms]
+        self.foodcourts = [Foodcourt(self.barracks[b_in], self.barracks[b_out], self.sheds[sh], rng=self.rng)
+                           for b_in, b_out, sh in self.config.foodcourts]
         self.transitions = self.factories + self.homes + self.farms + self.foodcourts
+        for building in self.transitions:
+            building.rate = self.config.transition_rates.get(building.name, building.rate)
+            building.duration = self.config.transition_durations.get(building.name, building.duration)
+        self.scheduler = make_scheduler(self.config, self.rng)
         self.resources = []
 
-        worker_id = 0
-        product_id = 0
-        food_id = 0
-
         # Funktion: Lägg till arbetare i varje barrack
         for barrack_instance in self.barracks:
-            for _ in range(100):
-                worker = Worker(id=worker_id)
-                barrack_instance.in_worker(worker)
-                worker_id += 1
+            count = self.config.workers_per_barrack
+            barrack_instance.spawn_workers(count, first_id=self.ids.reserve("worker", count))
             self.resources.append(barrack_instance)
         # Funktion: Lägg till produkter i varje förråd
         for storage_instance in self.storages:
-            for _ in range(200):
-                product = Product(id=product_id)
-                storage_instance.in_product(product)
-                product_id += 1
+            count = self.config.products_per_storage
+            storage_instance.add_products(count, first_id=self.ids.reserve("product", count))
             self.resources.append(storage_instance)
         # Funktion: Lägg till mat i varje lada
         for shed_instance in self.sheds:
-            for _ in range(100):
-                food = Food(id=food_id)
-                shed_instance.in_food(food)
-                food_id += 1
+            count = self.config.food_per_shed
+            shed_instance.add_food(count, first_id=self.ids.reserve("food", count))
             self.resources.append(shed_instance)
 
-        self.connection = sqlite3.connect("SIMSIMDATABASE.db")
-        self.curr = self.connection.cursor()
+        self.db_path = db_path
+        if logger is None and async_logging:
+            # Skrivartråden äger anslutningen, så att loopen inte väntar på disken
+            logger = AsyncLogger(db_path, queue_size=log_queue_size, backpressure=log_backpressure,
+                                 batch_size=log_batch_size, flush_interval_ms=log_flush_interval_ms,
+                                 journal_mode=journal_mode, synchronous=synchronous, run_id=run_id)
+        elif logger is None:
+            logger = SimulationLogger(db_path, batch_size=log_batch_size,
+                                      flush_interval_ms=log_flush_interval_ms,
+                                      journal_mode=journal_mode, synchronous=synchronous, run_id=run_id)
+        self.logger = logger
+        # Instrumentering är avstängd (None) som standard och kostar då bara en None-kontroll per steg;
+        # med True skrivs den till samma databas som loggen (eller hålls i minnet om loggen inte har någon databas)
+        if instrumentation is True:
+            instrumentation = Instrumentation(getattr(logger, "db_path", None))
+        self.instrumentation = instrumentation
+        # Körningens id i loggen; standard (None) är en ny körning som tilldelas när schemat sätts upp,
+        # så att två simulationer mot samma databas aldrig blandas ihop eller tömmer varandras rader
+        self.run_id = run_id
+        # reset_log är avstängt som standard; bara skriptets startpunkt skriver över en fast körning (run_id)
+        self.init_database(reset_log)
+        self.live_plot = None
+
+        # Stagnationsdetektorn och räknaren lever i instansen så att en körning kan fortsätta där den slutade
+        self.stagnation = StagnationDetector(self.config.stagnation_threshold, self.config.stagnation_delta)
+        self.stagnation_counter = 0
+        # Nästa steg att köra; en återställd ögonblicksbild fortsätter härifrån
+        self.step = 0
+        # Numpy-generatorn för batch-läget skapas av BatchTick vid första hoppet
+        self.batch_rng = None
+
+    # Funktion: init_database - Sätter upp loggens (och instrumenteringens) schema; reset tömmer tidigare körning
+    # Instrumenteringen märks med loggens run_id, som kan ha tilldelats först här (run_id=None)
+    def init_database(self, reset=True):
+        self.logger.init_schema(reset)
+        self.run_id = getattr(self.logger, "run_id", self.run_id)
+        if self.instrumentation is not None:
+            self.instrumentation.run_id = self.run_id
+            self.instrumentation.init_schema(reset)
 
     # Funktion: evaluate_resource_balance - Utvärderar resursbalansen och bestämmer prioriterade byggnader
     def evaluate_resource_balance(self):
@@ -307,8 +2182,9 @@ class main():
         }
         lowest_resource = min(resources.items(), key=lambda x: x[1])
 
-        # Använd en snäv marginal (0.8 istället för 0.75) för att fånga obalanser tidigare
-        if all(lowest_resource[1] < 0.8 * count for res, count in resources.items() if res != lowest_resource[0]):
+        # Använd en snäv marginal (standard 0.8 istället för 0.75) för att fånga obalanser tidigare
+        margin = self.config.balance_margin
+        if all(lowest_resource[1] < margin * count for res, count in resources.items() if res != lowest_resource[0]):
             if lowest_resource[0] == 'workers':
                 return self.homes
             elif lowest_resource[0] == 'food':
@@ -318,97 +2194,98 @@ class main():
 
         return []
 
-    # Funktion: count_total_products - Räknar totala antalet produkter
+    # Funktion: count_total_products - Returnerar totala antalet produkter (löpande summa)
     def count_total_products(self):
-        return sum(len(storage.storage) for storage in self.storages)
+        return self.counters.products
 
-    # Funktion: count_total_food - Räknar totala antalet matvaror
+    # Funktion: count_total_food - Returnerar totala antalet matvaror (löpande summa)
     def count_total_food(self):
-        return sum(len(shed.queue) for shed in self.sheds)
+        return self.counters.food
 
-    # Funktion: count_total_workers - Räknar totala antalet arbetare
+    # Funktion: count_total_workers - Returnerar totala antalet arbetare (löpande summa)
     def count_total_workers(self):
-        return sum(len(barrack.queue) for barrack in self.barracks)
+        return self.counters.workers
+
+    # Funktion: recount_resources - Räknar om summorna från behållarna, för kontroll av de löpande summorna
+    def recount_resources(self):
+        return {
+            'workers': sum(len(barrack.queue) for barrack in self.barracks),
+            'food': sum(len(shed.queue) for shed in self.sheds),
+            'products': sum(len(storage.storage) for storage in self.storages)
+        }
 
     # Funktion: print_simulation_status - Skriver ut simulationens status efter ett steg
     def print_simulation_status(self, step):
         print(f"\nStatus after step {step}:")
-        print(f"Workers in barrack in: {len(self.barracks[0].queue)}")
-        print(f"Workers in barrack out: {len(self.barracks[1].queue)}")
-        print(f"Food in shed: {len(self.sheds[0].queue)}")
-        print(f"Products in storage: {len(self.storages[0].storage)}")
+        for label, barrack in zip(["in", "out"] + list(range(2, len(self.barracks))), self.barracks):
+            print(f"Workers in barrack {label}: {len(barrack.queue)}")
+        print(f"Food in shed: {len(self.sheds[0].queue) if self.sheds else 0}")
+        print(f"Products in storage: {self.count_total_products()}")
 
-    # Funktion: plot_simulation_data - Plottar simulationens data från databasen
-    def plot_simulation_data(self, db_path):
-        conn = sqlite3.connect(db_path)
-        df = pd.read_sql_query("SELECT * FROM SimulationLog", conn)
-        conn.close()
-        plt.figure(figsize=(10, 6))
-        plt.plot(df['step'], df['workers'], label='Workers', color='blue')
-        plt.plot(df['step'], df['food'], label='Food', color='green')
-        plt.plot(df['step'], df['products'], label='Products', color='red')
-        plt.xlabel('Simulation Step')
-        plt.ylabel('Quantity')
-        plt.title('Simulation Data Over Time')
-        plt.legend()
-        plt.grid(True)
-        plt.show()
-
-    # Funktion: export_table_to_excel - Exporterar simulationens data till en Excel-fil
-    def export_table_to_excel(self, db_path, excel_path):
-        conn = sqlite3.connect(db_path)
-        df = pd.read_sql_query("SELECT * FROM SimulationLog", conn)
-        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='SimulationLog', index=False)
-        conn.close()
+    # Funktion: plot_simulation_data - Plottar en körning från databasen, nedsamplad till max_points per serie
+    def plot_simulation_data(self, db_path, output_path=None, max_points=2000, run_id=0):
+        plot_simulation_log(db_path, output_path, max_points, run_id)
+
+    # Funktion: export_table_to_excel - Exporterar simulationens data till en Excel-fil (bara för små körningar)
+    def export_table_to_excel(self, db_path, excel_path, run_id=0):
+        export_simulation_log(db_path, excel_path, "xlsx", run_id=run_id)
 
     # Funktion: log_simulation_status - Loggar simulationens status i databasen
-    def log_simulation_status(self, step):
-        workers_count = len(self.barracks[0].queue) + len(self.barracks[1].queue)
-        food_count = sum(len(shed.queue) for shed in self.sheds)
-        products_count = len(self.storages[0].storage)
-
-        self.curr.execute("SELECT COUNT(*) FROM SimulationLog WHERE step = ?", (step,))
-        count = self.curr.fetchone()[0]
-
-        if count == 0:
-            self.curr.execute("""
-            INSERT INTO SimulationLog (step, workers, food, products)
-            VALUES (?, ?, ?, ?)
-            """, (step, workers_count, food_count, products_count))
-        else:
-            self.curr.execute("""
-            UPDATE SimulationLog
-            SET workers = ?, food = ?, products = ?
-            WHERE step = ?
-            """, (workers_count, food_count, products_count, step))
+    def log_simulation_status(self, step, verbose=True):
+        workers_count = self.count_total_workers()
+        food_count = self.count_total_food()
+        products_count = self.count_total_products()
 
-        self.connection.commit()
-        print(f"Step {step}: Workers={workers_count}, Food={food_count}, Products={products_count}")
+        self.logger.log(step, workers_count, food_count, products_count)
+        if self.live_plot is not None:
+            self.live_plot.update(step, workers_count, food_count, products_count)
+        if verbose:
+            report(f"Step {step}: Workers={workers_count}, Food={food_count}, Products={products_count}", 1)
 
     # Funktion: _add_random_resources - Intervention: Lägger till slumpmässiga resurser för att bryta stagnation
     def _add_random_resources(self):
-        print("Intervention: Adding random resources")
-        new_workers = random.randint(10, 30)
+        report("Intervention: Adding random resources", 1)
+        config = self.config
+        new_workers = self.rng.randint(*config.new_workers)
         for _ in range(new_workers):
-            worker_id = self.count_total_workers() + 1
-            worker = Worker(id=worker_id, vitality=random.randint(50, 100))
-            random.choice(self.barracks).in_worker(worker)
-        new_food = random.randint(20, 40)
+            worker_id = self.ids.next_id("worker")
+            vitality = self.rng.randint(*config.new_worker_vitality)
+            self.rng.choice(self.barracks).spawn_worker(id=worker_id, vitality=vitality)
+        # Enheterna läggs in i dragningsordning, så att Foodcourt förbrukar kvaliteterna i samma ordning som förut;
+        # bara enheter i följd med samma kvalitet till samma behållare slås ihop till ett block
+        new_food = self.rng.randint(*config.new_food)
+        food_runs = {}
         for _ in range(new_food):
-            food_id = random.randint(1, 1000)
-            food = Food(id=food_id, quality=random.randint(1, 2))
-            random.choice(self.sheds).in_food(food)
-        new_products = random.randint(15, 35)
+            quality = self.rng.randint(*config.new_food_quality)
+            shed_index = self.rng.randrange(len(self.sheds))
+            run = food_runs.get(shed_index)
+            if run is not None and run[0] == quality:
+                run[1] += 1
+                continue
+            if run is not None:
+                self.sheds[shed_index].add_food(run[1], run[0], first_id=self.ids.reserve("food", run[1]))
+            food_runs[shed_index] = [quality, 1]
+        for shed_index, (quality, count) in food_runs.items():
+            self.sheds[shed_index].add_food(count, quality, first_id=self.ids.reserve("food", count))
+        new_products = self.rng.randint(*config.new_products)
+        product_run = None
         for _ in range(new_products):
-            product_id = random.randint(1, 1000)
-            product = Product(id=product_id, quality=random.randint(1, 3))
-            self.storages[0].in_product(product)
-        print(f"Added {new_workers} workers, {new_food} food, and {new_products} products")
+            quality = self.rng.randint(*config.new_product_quality)
+            if product_run is not None and product_run[0] == quality:
+                product_run[1] += 1
+                continue
+            if product_run is not None:
+                self.storages[0].add_products(product_run[1], product_run[0],
+                                              first_id=self.ids.reserve("product", product_run[1]))
+            product_run = [quality, 1]
+        if product_run is not None:
+            self.storages[0].add_products(product_run[1], product_run[0],
+                                          first_id=self.ids.reserve("product", product_run[1]))
+        report(f"Added {new_workers} workers, {new_food} food, and {new_products} products", 1)
 
     # Funktion: _shift_resource_balance - Intervention: Tar bort en procentandel av den mest överflödiga resursen
     def _shift_resource_balance(self):
-        print("Intervention: Shifting resource balance")
+        report("Intervention: Shifting resource balance", 1)
         workers = self.count_total_workers()
         food = self.count_total_food()
         products = self.count_total_products()
@@ -416,41 +2293,277 @@ class main():
         most_abundant = max(resources.items(), key=lambda x: x[1])[0]
 
         if most_abundant == "workers":
-            remove_count = int(workers * 0.3)
+            remove_count = int(workers * self.config.remove_workers_share)
             removed = 0
             for barrack in self.barracks:
-                while barrack.queue and removed < remove_count:
-                    barrack.queue.pop()
-                    removed += 1
-            print(f"Removed {removed} workers")
+                removed += barrack.remove_workers(remove_count - removed)
+            report(f"Removed {removed} workers", 1)
         elif most_abundant == "food":
-            remove_count = int(food * 0.2)
+            remove_count = int(food * self.config.remove_food_share)
             removed = 0
             for shed in self.sheds:
-                while shed.queue and removed < remove_count:
-                    shed.queue.pop()
-                    removed += 1
-            print(f"Removed {removed} food items")
+                removed += shed.remove_food(remove_count - removed)
+            report(f"Removed {removed} food items", 1)
         elif most_abundant == "products":
-            remove_count = int(products * 0.2)
+            remove_count = int(products * self.config.remove_products_share)
             removed = 0
-            while self.storages[0].storage and removed < remove_count:
-                self.storages[0].storage.pop()
-                removed += 1
-            print(f"Removed {removed} products")
+            for storage in self.storages:
+                removed += storage.remove_products(remove_count - removed)
+            report(f"Removed {removed} products", 1)
 
     # Funktion: run_simulation - Kör simulationen och hanterar interveneringar
-    def run_simulation(self):
-        step = 0
-        previous_counts = []
-        stagnation_counter = 0
-        stagnation_threshold = 15
+    # max_steps är det steg körningen slutar vid, så en återställd simulation kör bara de steg som återstår
+    def run_simulation(self, max_steps=900, verbosity=2, report_interval=1, step_delay=0.01,
+                       excel_path="simulation_data.xlsx", plot=True, tau=None, max_fraction=0.05,
+                       export_path=None, plot_path=None, live_plot_path=None, live_plot_interval=1000):
+        with VerbosityScope(verbosity):
+            if live_plot_path:
+                self.live_plot = LivePlot(live_plot_path, live_plot_interval)
+            try:
+                self.advance(max_steps, report_interval, step_delay, tau, max_fraction)
+                self.logger.flush()
+                if excel_path:
+                    self.export_table_to_excel(self.db_path, excel_path, self.run_id)
+                if export_path:
+                    export_simulation_log(self.db_path, export_path, run_id=self.run_id)
+                if plot:
+                    self.plot_simulation_data(self.db_path, plot_path, run_id=self.run_id)
+            finally:
+                if self.live_plot is not None:
+                    self.live_plot.close()
+                    self.live_plot = None
+                try:
+                    self.logger.close()
+                finally:
+                    if self.instrumentation is not None:
+                        self.instrumentation.close()
+
+    # Funktion: advance - Stegar fram till steget max_steps utan att stänga loggen, exportera eller plotta
+    def advance(self, max_steps, report_interval=10_000, step_delay=0, tau=None, max_fraction=0.05):
+        if report_interval < 1:
+            raise ValueError(f"report_interval must be >= 1, got {report_interval}")
+        if tau:
+            self._run_batch_loop(max_steps, report_interval, tau, max_fraction)
+        else:
+            self._run_loop(max_steps, report_interval, step_delay)
+
+    # Funktion: run_headless - Kör simulationen utan paus, plottning och Excel-export ("turbo"-läge)
+    def run_headless(self, max_steps=1_000_000, report_interval=10_000, verbosity=1, tau=None, max_fraction=0.05,
+                     export_path=None, plot_path=None, live_plot_path=None, live_plot_interval=10_000):
+        self.run_simulation(max_steps=max_steps, verbosity=verbosity, report_interval=report_interval,
+                            step_delay=0, excel_path=None, plot=bool(plot_path), tau=tau, max_fraction=max_fraction,
+                            export_path=export_path, plot_path=plot_path, live_plot_path=live_plot_path,
+                            live_plot_interval=live_plot_interval)
+
+    # Funktion: snapshot - Packar hela simulationens tillstånd (behållare, summor, id, RNG, stagnation, schemaläggare, steg) till bytes
+    def snapshot(self):
+        rng_version, rng_state, gauss_next = self.rng.getstate()
+        arrays = [("rng", array('q', rng_state))]
+        if self.population is not None:
+            arrays += [("population.ids", self.population.ids),
+                       ("population.vitality", self.population.vitality),
+                       ("population.location", self.population.location),
+                       ("population.free", array('q', self.population.free))]
+            arrays += [(f"barrack{i}", barrack.queue.to_array()) for i, barrack in enumerate(self.barracks)]
+        else:
+            for i, barrack in enumerate(self.barracks):
+                arrays += [(f"barrack{i}.ids", array('q', [worker.id for worker in barrack.queue])),
+                           (f"barrack{i}.vitality", array('h', [worker.vitality for worker in barrack.queue])),
+                           (f"barrack{i}.location",
+                            array('b', [LOCATION_CODES[worker.location] for worker in barrack.queue]))]
+        goods = [(f"storage{i}", storage.storage) for i, storage in enumerate(self.storages)]
+        goods += [(f"shed{i}", shed.queue) for i, shed in enumerate(self.sheds)]
+        for name, items in goods:
+            if self.counted_inventory:
+                arrays += [(f"{name}.quality", array('q', [quality for quality, _ in items])),
+                           (f"{name}.count", array('q', [count for _, count in items]))]
+            else:
+                arrays += [(f"{name}.ids", array('q', [item.id for item in items])),
+                           (f"{name}.quality", array('q', [item.quality for item in items]))]
+        for res in self.stagnation.resources:
+            for kind in ("maxima", "minima"):
+                window = getattr(self.stagnation, kind)[res]
+                arrays += [(f"stagnation.{kind}.{res}.index", array('q', [index for index, _ in window])),
+                           (f"stagnation.{kind}.{res}.value", array('q', [value for _, value in window]))]
+        header = {
+            "version": 1,
+            "config": self.config.to_dict(),
+            "columnar_workers": self.columnar_workers,
+            "counted_inventory": self.counted_inventory,
+            "step": self.step,
+            "stagnation_counter": self.stagnation_counter,
+            "stagnation": {"count": self.stagnation.count, "first_index": self.stagnation.first_index,
+                           "last_index": self.stagnation.last_index},
+            "counters": [self.counters.workers, self.counters.food, self.counters.products],
+            "next_ids": self.ids.next_ids,
+            "rng": [rng_version, gauss_next],
+            "batch_rng": self.batch_rng.bit_generator.state if self.batch_rng is not None else None,
+            "active": [building.set_active for building in self.transitions],
+        }
+        if isinstance(self.scheduler, EventScheduler):
+            scheduler = self.scheduler
+            arrays += [("scheduler.time", array('d', [event[0] for event in scheduler.queue])),
+                       ("scheduler.sequence", array('q', [event[1] for event in scheduler.queue])),
+                       ("scheduler.index", array('q', [event[2] for event in scheduler.queue])),
+                       ("scheduler.version", array('q', [event[3] for event in scheduler.queue]))]
+            header["scheduler"] = {"sequence": scheduler.sequence,
+                                   "busy_until": list(scheduler.busy_until.items()),
+                                   "versions": list(scheduler.versions.items()),
+                                   "multipliers": list(scheduler.multipliers.items())}
+        return pack_snapshot(header, arrays)
+
+    # Funktion: save_checkpoint - Skriver en ögonblicksbild till fil (via en temporär fil, så att en gammal aldrig skrivs sönder)
+    def save_checkpoint(self, path):
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(self.snapshot())
+        os.replace(temporary_path, path)
 
-        while step < 900:
+    # Funktion: restore - Skapar en simulation från en ögonblicksbild (bytes eller filsökväg) som fortsätter vid dess steg
+    # seed drar om slumpgeneratorn (för nya grenar); config_changes får ändra allt utom byggnadskopplingen
+    # Utan db_path eller logger loggas till en MemoryLogger, så att en återställning aldrig rör en befintlig logg
+    @classmethod
+    def restore(cls, source, seed=None, config_changes=None, **options):
+        if "db_path" not in options and "logger" not in options:
+            options["logger"] = MemoryLogger()
+        options.setdefault("reset_log", False)
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                source = f.read()
+        header, arrays = unpack_snapshot(source)
+        if header["version"] != 1:
+            raise ValueError(f"Unsupported snapshot version: {header['version']}")
+        config = SimulationConfig.from_dict(header["config"])
+        if config_changes:
+            wiring = ("barracks", "storages", "sheds", "factories", "homes", "farms", "foodcourts")
+            changed = [field for field in wiring if field in config_changes]
+            if changed:
+                raise ValueError(f"Cannot change building wiring of a snapshot: {', '.join(changed)}")
+            config = config.replace(**config_changes)
+        # Bygg kolonin utan startpopulation; innehållet kommer från ögonblicksbilden
+        empty = config.replace(workers_per_barrack=0, products_per_storage=0, food_per_shed=0)
+        simulation = cls(config=empty, columnar_workers=header["columnar_workers"],
+                         counted_inventory=header["counted_inventory"], seed=0, **options)
+        simulation.config = config
+        simulation._load_state(header, arrays)
+        if seed is not None:
+            simulation.rng.seed(seed)
+            simulation.batch_rng = None
+        return simulation
+
+    # Funktion: _load_state - Lägger in tillståndet från en uppackad ögonblicksbild i en nybyggd simulation
+    def _load_state(self, header, arrays):
+        rng_version, gauss_next = header["rng"]
+        self.rng.setstate((rng_version, tuple(arrays["rng"]), gauss_next))
+        if header["batch_rng"] is not None:
+            import numpy as np
+            self.batch_rng = np.random.default_rng()
+            self.batch_rng.bit_generator.state = header["batch_rng"]
+        if self.population is not None:
+            self.population.ids = arrays["population.ids"]
+            self.population.vitality = arrays["population.vitality"]
+            self.population.location = arrays["population.location"]
+            self.population.free = list(arrays["population.free"])
+            for i, barrack in enumerate(self.barracks):
+                barrack.queue = IndexRing(max(16, len(arrays[f"barrack{i}"])))
+                barrack.queue.extend(arrays[f"barrack{i}"])
+        else:
+            for i, barrack in enumerate(self.barracks):
+                barrack.queue = deque()
+                for id, vitality, location in zip(arrays[f"barrack{i}.ids"], arrays[f"barrack{i}.vitality"],
+                                                  arrays[f"barrack{i}.location"]):
+                    worker = Worker(id=id, vitality=vitality)
+                    worker.location = LOCATIONS[location]
+                    barrack.queue.append(worker)
+        goods = [(f"storage{i}", storage, "storage", Product) for i, storage in enumerate(self.storages)]
+        goods += [(f"shed{i}", shed, "queue", Food) for i, shed in enumerate(self.sheds)]
+        for name, container, attribute, kind in goods:
+            if self.counted_inventory:
+                items = QualityBlocks()
+                for quality, count in zip(arrays[f"{name}.quality"], arrays[f"{name}.count"]):
+                    items.append(quality, count)
+            else:
+                items = deque(kind.shared(quality) if id == 0 else kind(id=id, quality=quality)
+                              for id, quality in zip(arrays[f"{name}.ids"], arrays[f"{name}.quality"]))
+            setattr(container, attribute, items)
+        self.counters.workers, self.counters.food, self.counters.products = header["counters"]
+        self.ids.next_ids = dict(header["next_ids"])
+        stagnation = header["stagnation"]
+        self.stagnation.count = stagnation["count"]
+        self.stagnation.first_index = stagnation["first_index"]
+        self.stagnation.last_index = stagnation["last_index"]
+        for res in self.stagnation.resources:
+            for kind in ("maxima", "minima"):
+                window = getattr(self.stagnation, kind)[res]
+                window.clear()
+                window.extend(zip(arrays[f"stagnation.{kind}.{res}.index"], arrays[f"stagnation.{kind}.{res}.value"]))
+        for building, active in zip(self.transitions, header["active"]):
+            building.set_active = active
+        self.scheduler.invalidate()
+        if "scheduler" in header:
+            scheduler, state = self.scheduler, header["scheduler"]
+            scheduler.queue = list(zip(arrays["scheduler.time"], arrays["scheduler.sequence"],
+                                       arrays["scheduler.index"], arrays["scheduler.version"]))
+            scheduler.sequence = state["sequence"]
+            scheduler.busy_until = dict((index, value) for index, value in state["busy_until"])
+            scheduler.versions = dict((index, value) for index, value in state["versions"])
+            scheduler.multipliers = dict((index, value) for index, value in state["multipliers"])
+        self.step = header["step"]
+        self.stagnation_counter = header["stagnation_counter"]
+
+    # Funktion: fork - Skapar count grenar från nuvarande tillstånd, var och en med egen seed
+    # Utan db_path eller logger får varje gren (via restore) en egen MemoryLogger
+    def fork(self, count, seed=0, config_changes=None, **options):
+        data = self.snapshot()
+        seed_source = random.Random(seed)
+        return [main.restore(data, seed=seed_source.getrandbits(64), config_changes=config_changes, **options)
+                for _ in range(count)]
+
+    # Funktion: _handle_stagnation - Uppdaterar stagnationsdetektorn och gör en intervention vid stagnation
+    def _handle_stagnation(self, current_counts, step=None):
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter_ns()
+        stagnated = self.stagnation.update(current_counts, step)
+        if instrumentation is not None:
+            instrumentation.record_phase("stagnation", time.perf_counter_ns() - start)
+        if stagnated:
+            self.stagnation_counter += 1
+            report(f"Stagnation detected! Counter: {self.stagnation_counter}", 1)
+            if instrumentation is not None:
+                start = time.perf_counter_ns()
+            if self.stagnation_counter % 2 == 0:
+                self._add_random_resources()
+            else:
+                self._shift_resource_balance()
+            if instrumentation is not None:
+                instrumentation.record_phase("intervention", time.perf_counter_ns() - start)
+        else:
+            self.stagnation_counter = 0
+
+    # Funktion: _log_step - Loggar steget och mäter tiden för det när instrumenteringen är på
+    def _log_step(self, step, verbose):
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            self.log_simulation_status(step, verbose)
+            return
+        start = time.perf_counter_ns()
+        self.log_simulation_status(step, verbose)
+        instrumentation.record_phase("logging", time.perf_counter_ns() - start)
+
+    # Funktion: _run_loop - Stegar simulationen tills den tar slut eller når steggränsen
+    def _run_loop(self, max_steps, report_interval, step_delay):
+        step = self.step
+        instrumentation = self.instrumentation
+        transition_index = {id(t): index for index, t in enumerate(self.transitions)}
+
+        while step < max_steps:
             try:
-                print(f"\nSimulation step {step}:")
+                verbose = step % report_interval == 0
+                if verbose:
+                    report(f"\nSimulation step {step}:")
                 if not any(barrack.exist_worker() for barrack in self.barracks):
-                    print("All workers have died, simulation ending...")
+                    report("All workers have died, simulation ending...", 1)
                     break
 
                 current_counts = {
@@ -458,56 +2571,618 @@ class main():
                     'food': self.count_total_food(),
                     'products': self.count_total_products()
                 }
+                self._handle_stagnation(current_counts)
 
-                if len(previous_counts) > stagnation_threshold:
-                    is_stagnant = True
-                    for prev_count in previous_counts[-stagnation_threshold:]:
-                        if any(abs(current_counts[res] - prev_count[res]) > 5 for res in current_counts):
-                            is_stagnant = False
-                            break
-                    if is_stagnant:
-                        stagnation_counter += 1
-                        print(f"Stagnation detected! Counter: {stagnation_counter}")
-                        if stagnation_counter % 2 == 0:
-                            self._add_random_resources()
-                        else:
-                            self._shift_resource_balance()
-                    else:
-                        stagnation_counter = 0
-
-                previous_counts.append(current_counts)
-                if len(previous_counts) > stagnation_threshold + 5:
-                    previous_counts.pop(0)
-
-                # Återställ alla byggnader till inaktiva
-                for building in self.transitions:
-                    building.set_active = False
-
-                # NY: Slumpmässigt välj en byggnad som ska producera varje steg
-                t = random.choice(self.transitions)
-                t.set_active = True
-                try:
-                    t.produce()
-                except Exception as e:
-                    print(f"Error in {t.name}.produce() in step {step}: {e}")
+                # Schemaläggaren väljer vilka byggnader som producerar detta steg
+                for t in self.scheduler.select(self, step):
+                    if instrumentation is None:
+                        try:
+                            t.produce()
+                        except Exception as e:
+                            report(f"Error in {t.name}.produce() in step {step}: {e}", 1)
+                        continue
+                    start = time.perf_counter_ns()
+                    try:
+                        outcome = t.produce()
+                    except Exception as e:
+                        outcome = OUTCOME_ERROR
+                        report(f"Error in {t.name}.produce() in step {step}: {e}", 1)
+                    instrumentation.record_transition(step, transition_index[id(t)], t.name, outcome,
+                                                      time.perf_counter_ns() - start)
 
-                self.print_simulation_status(step)
-                self.log_simulation_status(step)
+                if verbose and current_verbosity() >= 2:
+                    self.print_simulation_status(step)
+                self._log_step(step, verbose)
 
                 if not any(storage.exist_product() for storage in self.storages):
-                    print("No products left in storage, simulation ending...")
+                    report("No products left in storage, simulation ending...", 1)
+                    # Steget är klart och loggat, så en återställd körning ska inte köra om det
+                    self.step = step + 1
                     break
 
-                time.sleep(0.01)
+                if step_delay:
+                    time.sleep(step_delay)
                 step += 1
+                self.step = step
+            except (LogWriterError, sqlite3.Error):
+                # Loggen går inte att skriva: att köra om steget skulle bara upprepa samma fel för alltid
+                raise
             except Exception as e:
-                print(f"Unexpected error in simulation loop: {e}")
+                report(f"Unexpected error in simulation loop: {e}", 1)
+
+    # Funktion: _run_batch_loop - Stegar simulationen med tau-leaping; stagnation kontrolleras och loggas per hopp
+    # Med instrumentering mäts hela hoppet som fasen "leap", eftersom enskilda avfyrningar inte körs var för sig
+    def _run_batch_loop(self, max_steps, report_interval, tau, max_fraction):
+        batch = BatchTick(self, tau, max_fraction)
+        step = self.step
+        next_report = step
+        instrumentation = self.instrumentation
+        while step < max_steps:
+            if not any(barrack.exist_worker() for barrack in self.barracks):
+                report("All workers have died, simulation ending...", 1)
+                break
+
+            current_counts = {
+                'workers': self.count_total_workers(),
+                'food': self.count_total_food(),
+                'products': self.count_total_products()
+            }
+            self._handle_stagnation(current_counts, step)
+
+            if instrumentation is None:
+                step += batch.leap(max_steps - step)
+            else:
+                start = time.perf_counter_ns()
+                step += batch.leap(max_steps - step)
+                instrumentation.record_phase("leap", time.perf_counter_ns() - start)
+            self.step = step
+            verbose = step >= next_report
+            if verbose:
+                next_report = step + report_interval
+            self._log_step(step - 1, verbose)
+
+            if not any(storage.exist_product() for storage in self.storages):
+                report("No products left in storage, simulation ending...", 1)
+                break
+
+# Funktion: _run_replica - Kör en seedad replika utan databas och returnerar dess (workers, food, products) per steg
+def _run_replica(task):
+    seed, max_steps, options, run_options = task
+    logger = MemoryLogger()
+    simulation = main(seed=seed, logger=logger, **options)
+    simulation.run_simulation(max_steps=max_steps, verbosity=0, step_delay=0, excel_path=None, plot=False,
+                              **run_options)
+    return _dense_trajectory(logger.rows)
+
+# Funktion: _dense_trajectory - Gör om loggrader till en rad per steg; steg som ett hopp (tau) passerat fylls med föregående värde
+def _dense_trajectory(rows):
+    trajectory = []
+    previous = None
+    for step, workers, food, products in rows:
+        while len(trajectory) < step:
+            trajectory.append(previous if previous is not None else (workers, food, products))
+        previous = (workers, food, products)
+        trajectory.append(previous)
+    return trajectory
+
+# Funktion: _quantile - Linjärt interpolerad kvantil ur en sorterad lista
+def _quantile(sorted_values, q):
+    position = (len(sorted_values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+# Funktion: run_ensemble - Kör N oberoende seedade simulationer i en processpool och sammanställer statistik per steg
+def run_ensemble(replicas=100, seed=0, max_steps=900, processes=None, quantiles=(0.05, 0.5, 0.95),
+                 run_options=None, **options):
+    seed_source = random.Random(seed)
+    seeds = [seed_source.getrandbits(64) for _ in range(replicas)]
+    tasks = [(replica_seed, max_steps, options, run_options or {}) for replica_seed in seeds]
+    if processes == 1:
+        trajectories = [_run_replica(task) for task in tasks]
+    else:
+        processes = processes or os.cpu_count()
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            trajectories = list(pool.map(_run_replica, tasks, chunksize=max(1, replicas // (4 * processes))))
+
+    # Replikor som tar slut tidigt fylls ut med sitt sista tillstånd så att utdöd förblir utdöd
+    length = max(len(trajectory) for trajectory in trajectories)
+    for trajectory in trajectories:
+        trajectory.extend([trajectory[-1] if trajectory else (0, 0, 0)] * (length - len(trajectory)))
 
-        self.export_table_to_excel("SIMSIMDATABASE.db", "simulation_data.xlsx")
-        self.plot_simulation_data("SIMSIMDATABASE.db")
+    result = {"replicas": replicas, "seeds": seeds, "steps": length}
+    for column, resource in enumerate(RESOURCES):
+        stats = {"mean": [], "extinction": []}
+        stats.update({f"q{round(q * 100):02d}": [] for q in quantiles})
+        for step in range(length):
+            values = sorted(trajectory[step][column] for trajectory in trajectories)
+            stats["mean"].append(sum(values) / replicas)
+            stats["extinction"].append(sum(1 for value in values if value == 0) / replicas)
+            for q in quantiles:
+                stats[f"q{round(q * 100):02d}"].append(_quantile(values, q))
+        stats["final_extinction"] = stats["extinction"][-1] if length else 0.0
+        result[resource] = stats
+    return result
+
+# Tillåtna interventioner för en gren i run_branches (namn på main-metoder utan inledande understreck)
+BRANCH_INTERVENTIONS = ("add_random_resources", "shift_resource_balance")
+
+# Funktion: _run_branch - Återställer en gren från ögonblicksbilden, gör dess interventioner och kör den utan databas
+def _run_branch(task):
+    data, branch, max_steps, run_options = task
+    for name in branch.get("interventions", ()):
+        if name not in BRANCH_INTERVENTIONS:
+            raise ValueError(f"Unknown intervention: {name}")
+    logger = MemoryLogger()
+    simulation = main.restore(data, seed=branch.get("seed"), config_changes=branch.get("config"), logger=logger)
+    for name in branch.get("interventions", ()):
+        getattr(simulation, f"_{name}")()
+    simulation.run_simulation(max_steps=max_steps, verbosity=0, step_delay=0, excel_path=None, plot=False,
+                              **run_options)
+    return logger.rows
+
+# Funktion: run_branches - Kör många what-if-grenar från samma ögonblicksbild parallellt, utan att köra om uppvärmningen
+# Varje gren är en dict med valfria nycklar "seed", "config" (ändringar) och "interventions"; returnerar loggraderna per gren
+def run_branches(snapshot, branches, max_steps=900, processes=None, run_options=None):
+    if isinstance(snapshot, (str, os.PathLike)):
+        with open(snapshot, "rb") as f:
+            snapshot = f.read()
+    tasks = [(snapshot, branch, max_steps, run_options or {}) for branch in branches]
+    if processes == 1 or len(tasks) <= 1:
+        return [_run_branch(task) for task in tasks]
+    processes = processes or os.cpu_count()
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_run_branch, tasks, chunksize=max(1, len(tasks) // (4 * processes))))
+
+# Funktion: _relative_errors - Relativa avvikelser per steg mellan två ensemblers medelbanor för en resurs
+def _relative_errors(reference, other, resource):
+    length = min(reference["steps"], other["steps"])
+    return [abs(b - e) / max(1.0, abs(e))
+            for e, b in zip(reference[resource]["mean"][:length], other[resource]["mean"][:length])]
+
+# Funktion: compare_batch_accuracy - Jämför medelbanor från batch-läget (tau-leaping) mot den exakta händelsevägen
+# En andra exakt ensemble med andra seeds ger brusgolvet: avvikelsen som slumpen ensam ger vid samma antal replikor.
+# Batch-läget är bara mätbart snedvridet där dess fel ligger tydligt över brusgolvet
+def compare_batch_accuracy(replicas=20, seed=0, max_steps=500, tau=10, max_fraction=0.05, processes=1, config=None):
+    options = {"columnar_workers": True, "counted_inventory": True, "config": config}
+    started = time.perf_counter()
+    exact = run_ensemble(replicas, seed, max_steps, processes, run_options={}, **options)
+    exact_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    batched = run_ensemble(replicas, seed, max_steps, processes,
+                           run_options={"tau": tau, "max_fraction": max_fraction}, **options)
+    batch_seconds = time.perf_counter() - started
+    reference = run_ensemble(replicas, seed + 1, max_steps, processes, run_options={}, **options)
+
+    result = {"tau": tau, "max_fraction": max_fraction, "replicas": replicas,
+              "speedup": exact_seconds / batch_seconds if batch_seconds else float("inf")}
+    for resource in RESOURCES:
+        errors = _relative_errors(exact, batched, resource)
+        noise = _relative_errors(exact, reference, resource)
+        result[resource] = {
+            "max_rel_error": max(errors) if errors else 0.0,
+            "mean_rel_error": sum(errors) / len(errors) if errors else 0.0,
+            "noise_max_rel_error": max(noise) if noise else 0.0,
+            "noise_mean_rel_error": sum(noise) / len(noise) if noise else 0.0,
+            "extinction_exact": exact[resource]["final_extinction"],
+            "extinction_batch": batched[resource]["final_extinction"],
+        }
+    return result
+
+# Klass: SweepCache - Sparar resultat från parametersvep i SQLite, nycklade på hash av (konfiguration, seed)
+class SweepCache:
+    # Konstruktor: Öppnar cache-databasen och skapar tabellen vid behov
+    def __init__(self, path="simsim_sweep_cache.db"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS SweepResults (
+            key TEXT PRIMARY KEY,
+            config TEXT,
+            seed INTEGER,
+            max_steps INTEGER,
+            result TEXT
+        )
+        """)
+        self.connection.commit()
+
+    # Funktion: get_many - Hämtar cachade resultat för en lista nycklar
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT key, result FROM SweepResults WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            found.update((key, json.loads(result)) for key, result in rows)
+        return found
+
+    # Funktion: put_many - Sparar nya resultat i en transaktion
+    def put_many(self, entries):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO SweepResults (key, config, seed, max_steps, result) VALUES (?, ?, ?, ?, ?)",
+                [(key, config.canonical(), seed, max_steps, json.dumps(result))
+                 for key, config, seed, max_steps, result in entries])
+
+    # Funktion: close - Stänger cache-databasen
+    def close(self):
         self.connection.close()
 
+# Funktion: _run_sweep_point - Kör en punkt i ett svep och sammanfattar dess bana
+def _run_sweep_point(task):
+    trajectory = _run_replica(task)
+    summary = {"steps": len(trajectory)}
+    for column, resource in enumerate(RESOURCES):
+        values = [row[column] for row in trajectory] or [0]
+        summary[resource] = {"final": values[-1], "min": min(values), "max": max(values),
+                             "mean": sum(values) / len(values)}
+        summary[f"{resource}_extinct"] = values[-1] == 0
+    return summary
+
+# Funktion: grid_points - Alla kombinationer av värdena i ett rutnät {parameter: [värden]}
+def grid_points(base_config, grid):
+    names = list(grid)
+    return [base_config.replace(**dict(zip(names, values)))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+# Funktion: random_points - Slumpade konfigurationer; (låg, hög) dras likformigt, listor väljs från
+def random_points(base_config, space, samples, seed=0):
+    rng = random.Random(seed)
+    points = []
+    for _ in range(samples):
+        changes = {}
+        for name, domain in space.items():
+            if isinstance(domain, tuple):
+                low, high = domain
+                if isinstance(low, int) and isinstance(high, int):
+                    changes[name] = rng.randint(low, high)
+                else:
+                    changes[name] = rng.uniform(low, high)
+            else:
+                changes[name] = rng.choice(domain)
+        points.append(base_config.replace(**changes))
+    return points
+
+# Funktion: run_sweep - Kör ett rutnäts- eller slumpsvep parallellt och räknar bara ut punkter som saknas i cachen
+def run_sweep(base_config=None, grid=None, space=None, samples=0, sample_seed=0, seeds=(0,), max_steps=900,
+              processes=None, cache_path="simsim_sweep_cache.db", **options):
+    base_config = base_config if base_config is not None else SimulationConfig()
+    configs = []
+    if grid:
+        configs.extend(grid_points(base_config, grid))
+    if space:
+        configs.extend(random_points(base_config, space, samples, sample_seed))
+    if not configs:
+        configs.append(base_config)
+
+    points = [(config.key(seed, max_steps=max_steps), config, seed) for config in configs for seed in seeds]
+    cache = SweepCache(cache_path) if cache_path else None
+    try:
+        cached = cache.get_many(key for key, _, _ in points) if cache else {}
+        missing = [(key, config, seed) for key, config, seed in points if key not in cached]
+        tasks = [(seed, max_steps, dict(options, config=config), {}) for _, config, seed in missing]
+        if processes == 1 or len(tasks) <= 1:
+            computed = [_run_sweep_point(task) for task in tasks]
+        else:
+            processes = processes or os.cpu_count()
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                computed = list(pool.map(_run_sweep_point, tasks,
+                                         chunksize=max(1, len(tasks) // (4 * processes))))
+        fresh = {key: result for (key, _, _), result in zip(missing, computed)}
+        if cache and missing:
+            cache.put_many((key, config, seed, max_steps, fresh[key]) for key, config, seed in missing)
+    finally:
+        if cache:
+            cache.close()
+
+    return [{"config": config, "seed": seed, "cached": key in cached,
+             "result": cached[key] if key in cached else fresh[key]}
+            for key, config, seed in points]
+
+# Klass: ColonyLogger - Loggar en kolonis stegrader som (koloni, steg, ...) i skärvans gemensamma radlista
+class ColonyLogger:
+    # Konstruktor: Binder loggern till ett kolonins nummer och skärvans radlista
+    def __init__(self, colony, rows):
+        self.colony = colony
+        self.rows = rows
+
+    # Funktion: init_schema - Schemat skapas av run_colonies, inte per koloni
+    def init_schema(self, reset=True):
+        pass
+
+    # Funktion: log - Sparar en stegrad märkt med kolonins nummer
+    def log(self, step, workers, food, products):
+        self.rows.append((self.colony, step, workers, food, products))
+
+    # Funktion: flush - Skärven skriver raderna efter varje epok
+    def flush(self):
+        pass
+
+    # Funktion: close - Inget att stänga för en kolonilogg
+    def close(self):
+        pass
+
+# Funktion: _colony_emigrants - Tar ut en andel share av kolonins arbetare, mat och produkter som en flyttbatch
+# Batchen packas som array('q'): [antal arbetare, vitality..., antal matblock, (kvalitet, antal)..., antal produktblock, (kvalitet, antal)...]
+def _colony_emigrants(colony, share, capacity):
+    vitalities = []
+    for barrack in colony.barracks:
+        vitalities += barrack.emigrate_workers(int(len(barrack.queue) * share))
+    food, products = {}, {}
+    for shed in colony.sheds:
+        for quality, count in shed.emigrate_food(int(len(shed.queue) * share)).items():
+            food[quality] = food.get(quality, 0) + count
+    for storage in colony.storages:
+        for quality, count in storage.emigrate_products(int(len(storage.storage) * share)).items():
+            products[quality] = products.get(quality, 0) + count
+    batch = array('q', [len(vitalities)])
+    batch.extend(vitalities)
+    for blocks in (food, products):
+        batch.append(len(blocks))
+        for quality, count in sorted(blocks.items()):
+            batch.extend((quality, count))
+    if len(batch) > capacity:
+        raise ValueError(f"Migration batch of {len(batch)} values exceeds mailbox capacity {capacity}")
+    return batch
+
+# Funktion: _colony_immigrants - Lägger in en flyttbatch i kolonin; arbetarna får nya lokala id och fördelas över barrackerna
+def _colony_immigrants(colony, batch):
+    position = 1 + batch[0]
+    for offset, vitality in enumerate(batch[1:position]):
+        colony.barracks[offset % len(colony.barracks)].spawn_worker(id=colony.ids.next_id("worker"), vitality=vitality)
+    for containers in (colony.sheds, colony.storages):
+        blocks = batch[position]
+        position += 1
+        for _ in range(blocks):
+            quality, count = batch[position], batch[position + 1]
+            position += 2
+            if containers and count:
+                if containers is colony.sheds:
+                    containers[0].add_food(count, quality)
+                else:
+                    containers[0].add_products(count, quality)
+
+# Funktion: _run_shard - Stegar skärvans kolonier epok för epok och utbyter flyttbatcher med grannskärvorna i en ring
+# Med flera skärvor går batchen från skärvans sista koloni via delat minne till nästa skärvas första koloni
+def _run_shard(task, barrier=None, results=None):
+    (shard, shards, colonies, max_steps, migration_interval, migration_share, mailbox, capacity,
+     shard_path, tau, options) = task
+    # Skärvan kan köras i anroparens process (shards=1), så utskrifterna stängs av bara för den här tråden
+    with VerbosityScope(0):
+        shared = view = None
+        rows = []
+        migrated = [0, 0, 0]
+        connection = sqlite3.connect(shard_path)
+        try:
+            connection.execute("PRAGMA journal_mode=OFF")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute("CREATE TABLE ColonyLog (colony INTEGER, step INTEGER, workers INTEGER, "
+                               "food INTEGER, products INTEGER, PRIMARY KEY (colony, step))")
+            if mailbox is not None:
+                from multiprocessing import shared_memory
+                shared = shared_memory.SharedMemory(name=mailbox)
+                view = shared.buf.cast('q')
+            simulations = [main(logger=ColonyLogger(colony, rows), config=config, seed=seed, **options)
+                           for colony, config, seed in colonies]
+            epoch = 0
+            while True:
+                end = min((epoch + 1) * migration_interval, max_steps)
+                for simulation in simulations:
+                    simulation.advance(end, tau=tau)
+                    # En koloni som stannat (t.ex. utdöd) hålls i takt så att invandrare kan väcka den nästa epok
+                    simulation.step = max(simulation.step, end)
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO ColonyLog VALUES (?, ?, ?, ?, ?)", rows)
+                rows.clear()
+                if end >= max_steps:
+                    break
+
+                # Alla kolonier lämnar sina emigranter innan någon tar emot, så att resultatet inte beror på skärvningen
+                outgoing = [_colony_emigrants(simulation, migration_share, capacity) for simulation in simulations]
+                if view is None:
+                    incoming = outgoing[-1]
+                else:
+                    # Dubbelbuffrat per epok: en skärva skriver epok e+2 först efter att alla passerat barriären för e+1
+                    parity = epoch % 2
+                    target = (((shard + 1) % shards) * 2 + parity) * (capacity + 1)
+                    batch = outgoing[-1]
+                    view[target] = len(batch)
+                    view[target + 1:target + 1 + len(batch)] = batch
+                    barrier.wait()
+                    source = (shard * 2 + parity) * (capacity + 1)
+                    incoming = array('q', view[source + 1:source + 1 + view[source]])
+                for simulation, batch in zip(simulations, [incoming] + outgoing[:-1]):
+                    _colony_immigrants(simulation, batch)
+                for batch in outgoing:
+                    migrated[0] += batch[0]
+                    position = 1 + batch[0]
+                    for resource in (1, 2):
+                        blocks = batch[position]
+                        migrated[resource] += sum(batch[position + 2 + 2 * i] for i in range(blocks))
+                        position += 1 + 2 * blocks
+                epoch += 1
+        except BaseException:
+            if barrier is not None:
+                barrier.abort()
+            raise
+        finally:
+            connection.close()
+            if view is not None:
+                view.release()
+            if shared is not None:
+                shared.close()
+        summary = {"shard": shard, "colonies": len(colonies), "migrated": dict(zip(RESOURCES, migrated))}
+        if results is not None:
+            results.put(summary)
+        return summary
+
+# Funktion: run_colonies - Kör många kolonier (var och en en SimulationConfig-topologi) fördelade på skärvor i egna processer
+# Var migration_interval:e steg flyttar varje koloni andelen migration_share av sina resurser till nästa koloni i en ring;
+# alla stegrader slås ihop i tabellen ColonyLog (och Colonies) i db_path under körningens run_id i ColonyRuns.
+# run_id=None lägger till en ny körning; ett givet run_id ersätter bara den körningens rader
+def run_colonies(colonies, max_steps=900, shards=None, migration_interval=10, migration_share=0.05, seed=0,
+                 db_path="SIMSIMDATABASE.db", mailbox_capacity=1 << 16, tau=None, run_id=None, **options):
+    if isinstance(colonies, int):
+        colonies = [DEFAULT_CONFIG] * colonies
+    colonies = list(colonies)
+    shards = max(1, min(shards or os.cpu_count(), len(colonies)))
+    seed_source = random.Random(seed)
+    specs = [(colony, config, seed_source.getrandbits(63)) for colony, config in enumerate(colonies)]
+    # Sammanhängande block av kolonier per skärva, så att ringen bara korsar en skärvgräns per granne
+    bounds = [len(specs) * shard // shards for shard in range(shards + 1)]
+    shard_paths = [f"{db_path}.shard{shard}" for shard in range(shards)]
+    for path in shard_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    started = time.perf_counter()
+    try:
+        if shards == 1:
+            summaries = [_run_shard((0, 1, specs, max_steps, migration_interval, migration_share, None,
+                                     mailbox_capacity, shard_paths[0], tau, options))]
+        else:
+            import multiprocessing
+            from multiprocessing import shared_memory
+            context = multiprocessing.get_context()
+            mailbox = shared_memory.SharedMemory(create=True, size=8 * shards * 2 * (mailbox_capacity + 1))
+            barrier = context.Barrier(shards)
+            results = context.Queue()
+            processes = []
+            try:
+                for shard in range(shards):
+                    task = (shard, shards, specs[bounds[shard]:bounds[shard + 1]], max_steps, migration_interval,
+                            migration_share, mailbox.name, mailbox_capacity, shard_paths[shard], tau, options)
+                    process = context.Process(target=_run_shard, args=(task, barrier, results),
+                                              name=f"simsim-shard-{shard}")
+                    process.start()
+                    processes.append(process)
+                summaries = []
+                while len(summaries) < shards and any(process.is_alive() for process in processes):
+                    try:
+                        summaries.append(results.get(timeout=0.5))
+                    except queue.Empty:
+                        pass
+                for process in processes:
+                    process.join()
+                failed = [process.name for process in processes if process.exitcode != 0]
+                while len(summaries) < shards and not results.empty():
+                    summaries.append(results.get())
+                if failed:
+                    raise RuntimeError(f"Colony shards failed: {', '.join(failed)}")
+            finally:
+                for process in processes:
+                    if process.is_alive():
+                        process.terminate()
+                mailbox.close()
+                mailbox.unlink()
+
+        # Slå ihop skärvornas loggar i databasen som en egen körning; tidigare körningar lämnas orörda
+        connection = sqlite3.connect(db_path)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS ColonyRuns (run_id INTEGER PRIMARY KEY, created TEXT, "
+                                   "colonies INTEGER, shards INTEGER, steps INTEGER)")
+                connection.execute("CREATE TABLE IF NOT EXISTS ColonyLog (run_id INTEGER NOT NULL, colony INTEGER, "
+                                   "step INTEGER, workers INTEGER, food INTEGER, products INTEGER, "
+                                   "PRIMARY KEY (run_id, colony, step)) WITHOUT ROWID")
+                connection.execute("CREATE TABLE IF NOT EXISTS Colonies (run_id INTEGER NOT NULL, colony INTEGER, "
+                                   "shard INTEGER, seed INTEGER, config TEXT, PRIMARY KEY (run_id, colony))")
+                created = time.strftime("%Y-%m-%dT%H:%M:%S")
+                if run_id is None:
+                    run_id = connection.execute(
+                        "INSERT INTO ColonyRuns (created, colonies, shards, steps) VALUES (?, ?, ?, ?)",
+                        (created, len(specs), shards, max_steps)).lastrowid
+                else:
+                    connection.execute("INSERT OR REPLACE INTO ColonyRuns VALUES (?, ?, ?, ?, ?)",
+                                       (run_id, created, len(specs), shards, max_steps))
+                    connection.execute("DELETE FROM ColonyLog WHERE run_id = ?", (run_id,))
+                    connection.execute("DELETE FROM Colonies WHERE run_id = ?", (run_id,))
+                connection.executemany("INSERT INTO Colonies VALUES (?, ?, ?, ?, ?)", [
+                    (run_id, colony,
+                     next(shard for shard in range(shards) if bounds[shard] <= colony < bounds[shard + 1]),
+                     colony_seed, config.canonical())
+                    for colony, config, colony_seed in specs])
+            for path in shard_paths:
+                connection.execute("ATTACH DATABASE ? AS shard", (path,))
+                with connection:
+                    connection.execute("INSERT INTO main.ColonyLog (run_id, colony, step, workers, food, products) "
+                                       "SELECT ?, colony, step, workers, food, products FROM shard.ColonyLog",
+                                       (run_id,))
+                connection.execute("DETACH DATABASE shard")
+        finally:
+            connection.close()
+    finally:
+        # Skärvornas temporära databaser tas bort, även när en skärva misslyckades
+        for path in shard_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    migrated = {resource: sum(summary["migrated"][resource] for summary in summaries) for resource in RESOURCES}
+    return {"run_id": run_id, "colonies": len(specs), "shards": shards, "steps": max_steps, "migrated": migrated,
+            "seconds": time.perf_counter() - started}
+
 # Huvudprogram: Startar simulationen
 if __name__ == "__main__":
-    simulation = main()
-    simulation.run_simulation()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Kör SimSim-simulationen")
+    parser.add_argument("--steps", type=int, default=900, help="Max antal steg")
+    parser.add_argument("--turbo", action="store_true", help="Ingen paus, plottning eller Excel-export")
+    parser.add_argument("--verbosity", type=int, default=None, help="0 = tyst, 1 = händelser, 2 = allt")
+    parser.add_argument("--report-interval", type=int, default=None, help="Skriv ut status var N:e steg")
+    parser.add_argument("--delay", type=float, default=0.01, help="Paus i sekunder mellan stegen")
+    parser.add_argument("--excel", default="simulation_data.xlsx", help="Excel-fil att exportera till")
+    parser.add_argument("--no-plot", action="store_true", help="Hoppa över plottningen")
+    parser.add_argument("--export", default=None, help="Strömmande export till .csv, .parquet eller .arrow")
+    parser.add_argument("--plot-file", default=None, help="Spara plotten som PNG/SVG i stället för att visa den")
+    parser.add_argument("--live-plot", default=None, help="Bildfil som uppdateras under körningen")
+    parser.add_argument("--live-plot-interval", type=int, default=1000, help="Uppdatera live-plotten var N:e steg")
+    parser.add_argument("--async-log", action="store_true", help="Skriv loggen från en bakgrundstråd")
+    parser.add_argument("--tau", type=int, default=None, help="Batch-läge (tau-leaping) med högst TAU steg per hopp")
+    parser.add_argument("--checkpoint", default=None, help="Spara en ögonblicksbild av tillståndet efter körningen")
+    parser.add_argument("--resume", default=None, help="Fortsätt från en ögonblicksbild (till --steps)")
+    parser.add_argument("--colonies", type=int, default=None, help="Kör N kolonier med migration i stället för en")
+    parser.add_argument("--shards", type=int, default=None, help="Antal processer för kolonierna (standard: alla kärnor)")
+    parser.add_argument("--run-id", type=int, default=0, help="Körningens id i loggen (standard 0)")
+    parser.add_argument("--new-run", action="store_true", help="Logga som en ny körning i stället för att skriva över")
+    parser.add_argument("--instrument", action="store_true", help="Spara övergångar och fastider i databasen")
+    args = parser.parse_args()
+
+    if args.colonies:
+        # Precis som en enskild körning skriver skriptet över koloni-körningen --run-id, om inte --new-run anges
+        summary = run_colonies(args.colonies, max_steps=args.steps, shards=args.shards, tau=args.tau,
+                               run_id=None if args.new_run else args.run_id,
+                               columnar_workers=bool(args.tau), counted_inventory=bool(args.tau))
+        print(f"Ran {summary['colonies']} colonies on {summary['shards']} shards in {summary['seconds']:.1f} s "
+              f"as colony run {summary['run_id']}, migrated {summary['migrated']}")
+        raise SystemExit(0)
+
+    instrumentation = True if args.instrument else None
+    run_id = None if args.new_run else args.run_id
+    if args.resume:
+        # Loggen från den tidigare körningen behålls och fylls på från ögonblicksbildens steg
+        simulation = main.restore(args.resume, db_path="SIMSIMDATABASE.db", async_logging=args.async_log,
+                                  instrumentation=instrumentation, reset_log=False, run_id=run_id)
+    else:
+        # Batch-läget kräver kolumnbaserade arbetare och räknade lager
+        simulation = main(columnar_workers=bool(args.tau), counted_inventory=bool(args.tau),
+                          async_logging=args.async_log, instrumentation=instrumentation, run_id=run_id,
+                          reset_log=True)
+    if args.turbo:
+        simulation.run_headless(max_steps=args.steps,
+                                report_interval=args.report_interval or 10_000,
+                                verbosity=1 if args.verbosity is None else args.verbosity,
+                                tau=args.tau, export_path=args.export, plot_path=args.plot_file,
+                                live_plot_path=args.live_plot, live_plot_interval=args.live_plot_interval)
+    else:
+        simulation.run_simulation(max_steps=args.steps,
+                                  verbosity=2 if args.verbosity is None else args.verbosity,
+                                  report_interval=args.report_interval or 1,
+                                  step_delay=args.delay, excel_path=args.excel or None,
+                                  plot=not args.no_plot, tau=args.tau, export_path=args.export,
+                                  plot_path=args.plot_file, live_plot_path=args.live_plot,
+                                  live_plot_interval=args.live_plot_interval)
+    if args.checkpoint:
+        simulation.save_checkpoint(args.checkpoint)
@@ -0,0 +1,221 @@
+import json
+import os
+import random
+import sqlite3
+import time
+
+from simsim import (DEFAULT_CONFIG, MemoryLogger, SimulationConfig, SimulationLogger, VerbosityScope,
+                    export_simulation_log, main, plot_simulation_log, report)
+
+# Benchmark: Mätpunkter som skrivs som JSON så att körningar från olika commits kan jämföras
+BENCHMARK_POPULATIONS = (100, 1_000, 10_000, 100_000, 1_000_000)
+BENCHMARK_BUILDINGS = ("factories", "homes", "farms", "foodcourts")
+
+# Kolonin som stegmätningen kör: standardkolonin tömmer förrådet efter ungefär 600 steg, så med tre fabriker
+# per barrack räcker produkterna och mätningen täcker alla begärda steg i stället för några millisekunder
+BENCHMARK_CONFIG = SimulationConfig(factories=((0, 1, 0), (1, 0, 0)) * 3)
+
+# Funktion: _benchmark_metric - Ett mätvärde med enhet och riktning ("higher" eller "lower" är bättre)
+def _benchmark_metric(value, unit, better):
+    return {"value": value, "unit": unit, "better": better}
+
+# Funktion: _git_commit - Returnerar aktuell commit-hash, eller None utanför ett git-arbetsträd
+def _git_commit():
+    import subprocess
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+# Funktion: benchmark_steps - Steg per sekund för run_headless mot en riktig SQLite-logg, bästa av repeats körningar
+# En koloni som dör innan steps steg är ett fel, eftersom mätningen då bara skulle täcka en bråkdel av stegen
+def benchmark_steps(directory, steps=20_000, seed=0, repeats=5, **options):
+    best = None
+    for repeat in range(repeats):
+        db_path = os.path.join(directory, f"bench_steps{repeat}.db")
+        simulation = main(db_path=db_path, seed=seed, config=BENCHMARK_CONFIG, **options)
+        start = time.perf_counter()
+        simulation.run_headless(max_steps=steps, verbosity=0)
+        elapsed = time.perf_counter() - start
+        connection = sqlite3.connect(db_path)
+        try:
+            done = connection.execute("SELECT COUNT(*) FROM SimulationLog WHERE run_id = ?",
+                                      (simulation.run_id,)).fetchone()[0]
+        finally:
+            connection.close()
+        if done < steps:
+            raise RuntimeError(f"Benchmark colony stopped after {done} of {steps} steps")
+        best = elapsed if best is None else min(best, elapsed)
+    return _benchmark_metric(steps / best, "steps/s", "higher")
+
+# Funktion: benchmark_produce - Medelkostnad för produce() per byggnadstyp; kolonin byggs om var block:e anrop
+def benchmark_produce(calls=20_000, block=1_000, seed=0, **options):
+    results = {}
+    for kind in BENCHMARK_BUILDINGS:
+        elapsed = 0.0
+        done = 0
+        while done < calls:
+            simulation = main(logger=MemoryLogger(), seed=seed + done, **options)
+            buildings = getattr(simulation, kind)
+            count = min(block, calls - done)
+            start = time.perf_counter_ns()
+            for index in range(count):
+                try:
+                    buildings[index % len(buildings)].produce()
+                except Exception:
+                    pass
+            elapsed += time.perf_counter_ns() - start
+            done += count
+        results[kind] = _benchmark_metric(elapsed / calls, "ns/call", "lower")
+    return results
+
+# Funktion: benchmark_logging - Kostnad per steg för log_simulation_status mot en riktig SQLite-logg
+def benchmark_logging(directory, steps=50_000, **options):
+    simulation = main(db_path=os.path.join(directory, "bench_log.db"), **options)
+    try:
+        start = time.perf_counter_ns()
+        for step in range(steps):
+            simulation.log_simulation_status(step, verbose=False)
+        simulation.logger.flush()
+        elapsed = time.perf_counter_ns() - start
+    finally:
+        simulation.logger.close()
+    return _benchmark_metric(elapsed / steps, "ns/step", "lower")
+
+# Beroenden som varje export-/plotjobb laddar; de importeras före mätningen så att importtiden inte räknas
+BENCHMARK_IMPORTS = {
+    "export_csv": ("csv",),
+    "export_parquet": ("pyarrow", "pyarrow.parquet"),
+    "export_xlsx": ("openpyxl",),
+    "plot_png": ("matplotlib.figure", "matplotlib.backends.backend_agg"),
+}
+
+# Funktion: benchmark_export_plot - Tid per rad för export och per anrop för headless plottning av en logg med rows rader
+# Plottningen läser rollups och beror inte på antalet rader; format vars beroende saknas hoppas över
+def benchmark_export_plot(directory, rows=100_000, seed=0):
+    import importlib
+
+    db_path = os.path.join(directory, "bench_export.db")
+    rng = random.Random(seed)
+    with SimulationLogger(db_path, batch_size=10_000) as logger:
+        logger.init_schema()
+        for step in range(rows):
+            logger.log(step, rng.randint(0, 500), rng.randint(0, 500), rng.randint(0, 500))
+    results = {}
+    jobs = [(f"export_{extension}", lambda extension=extension: export_simulation_log(
+                db_path, os.path.join(directory, f"bench_export.{extension}")))
+            for extension in ("csv", "parquet", "xlsx")]
+    jobs.append(("plot_png", lambda: plot_simulation_log(db_path, os.path.join(directory, "bench_plot.png"))))
+    for name, job in jobs:
+        try:
+            for module in BENCHMARK_IMPORTS[name]:
+                importlib.import_module(module)
+        except ImportError as e:
+            report(f"Benchmark {name} skipped: {e}", 1)
+            continue
+        start = time.perf_counter()
+        job()
+        elapsed = time.perf_counter() - start
+        if name == "plot_png":
+            results[name] = _benchmark_metric(elapsed * 1e3, "ms/call", "lower")
+        else:
+            results[name] = _benchmark_metric(elapsed * 1e6 / rows, "us/row", "lower")
+    return results
+
+# Funktion: benchmark_memory - Toppminne (tracemalloc) per startenhet för main.__init__ när startpopulationen skalas upp
+def benchmark_memory(populations=BENCHMARK_POPULATIONS, **options):
+    import gc
+    import tracemalloc
+
+    results = {}
+    for population in populations:
+        # Populationen delas lika mellan barrackerna; förråd och lador skalas i samma proportion som standardkolonin
+        config = SimulationConfig(workers_per_barrack=population // DEFAULT_CONFIG.barracks,
+                                  products_per_storage=population, food_per_shed=population // 2)
+        # Toppminnet delas med alla startenheter (arbetare, produkter och mat), inte bara arbetarna
+        units = (config.workers_per_barrack * config.barracks + config.products_per_storage * config.storages
+                 + config.food_per_shed * config.sheds)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            simulation = main(logger=MemoryLogger(), config=config, **options)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        del simulation
+        results[str(population)] = _benchmark_metric(peak / units, "B/unit", "lower")
+    return results
+
+# Funktion: run_benchmarks - Kör hela benchmark-sviten och returnerar en JSON-vänlig dict
+# quick kör färre steg och populationer upp till 1e4, för snabba kontroller
+def run_benchmarks(quick=False, seed=0):
+    import platform
+    import tempfile
+
+    scale = 10 if quick else 1
+    populations = BENCHMARK_POPULATIONS[:3] if quick else BENCHMARK_POPULATIONS
+    metrics = {}
+    with VerbosityScope(0), tempfile.TemporaryDirectory(prefix="simsim-bench-") as directory:
+        metrics["steps_per_second"] = benchmark_steps(directory, 20_000 // scale, seed)
+        metrics["steps_per_second_columnar"] = benchmark_steps(
+            directory, 20_000 // scale, seed, columnar_workers=True, counted_inventory=True)
+        for kind, metric in benchmark_produce(20_000 // scale, seed=seed).items():
+            metrics[f"produce_{kind}"] = metric
+        metrics["log_simulation_status"] = benchmark_logging(directory, 50_000 // scale)
+        for name, metric in benchmark_export_plot(directory, 100_000 // scale, seed).items():
+            metrics[name] = metric
+        for population, metric in benchmark_memory(populations).items():
+            metrics[f"memory_{population}"] = metric
+        for population, metric in benchmark_memory(populations, columnar_workers=True,
+                                                   counted_inventory=True).items():
+            metrics[f"memory_columnar_{population}"] = metric
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "metrics": metrics,
+    }
+
+# Funktion: compare_benchmarks - Returnerar mätvärden som blivit mer än tolerance (andel) sämre än baseline
+def compare_benchmarks(current, baseline, tolerance=0.20):
+    if baseline.get("quick") != current.get("quick"):
+        report("Benchmark baseline was run with a different --quick setting; results may not be comparable", 1)
+    regressions = []
+    for name, metric in current["metrics"].items():
+        old = baseline.get("metrics", {}).get(name)
+        if not old or not old["value"] or old["unit"] != metric["unit"]:
+            continue
+        change = (metric["value"] - old["value"]) / old["value"]
+        if metric["better"] == "higher":
+            change = -change
+        if change > tolerance:
+            regressions.append({"metric": name, "baseline": old["value"], "current": metric["value"],
+                                "unit": metric["unit"], "change": change})
+    return regressions
+
+# Huvudprogram: Kör benchmark-sviten, sparar resultatet och jämför valfritt mot en tidigare körning
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Kör SimSims benchmark-svit")
+    parser.add_argument("output", metavar="JSON", help="Fil att spara resultatet i")
+    parser.add_argument("--compare", default=None, metavar="JSON", help="Jämför med en tidigare JSON-fil")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Tillåten försämring innan regression (andel)")
+    parser.add_argument("--quick", action="store_true", help="Kortare benchmark-körning")
+    args = parser.parse_args()
+
+    results = run_benchmarks(quick=args.quick)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    for name, metric in results["metrics"].items():
+        print(f"{name}: {metric['value']:.4g} {metric['unit']}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare_benchmarks(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:.4g} -> "
+                  f"{regression['current']:.4g} {regression['unit']} ({regression['change']:+.0%})")
+        raise SystemExit(1 if regressions else 0)
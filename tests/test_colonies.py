@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+from simsim import run_colonies
+
+
+# Funktion: colony_rows - ColonyLog-raderna för en körning, utan run_id
+def colony_rows(db_path, run_id):
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute("SELECT colony, step, workers, food, products FROM ColonyLog WHERE run_id = ? "
+                                  "ORDER BY colony, step", (run_id,)).fetchall()
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("tau", [None, 10])
+def test_shard_count_does_not_change_rows(tmp_path, tau):
+    db_path = str(tmp_path / "colonies.db")
+    options = {"columnar_workers": True, "counted_inventory": True} if tau else {}
+    one = run_colonies(4, max_steps=200, shards=1, seed=3, db_path=db_path, tau=tau, **options)
+    two = run_colonies(4, max_steps=200, shards=2, seed=3, db_path=db_path, tau=tau, **options)
+    assert one["run_id"] != two["run_id"]
+    assert one["migrated"] == two["migrated"]
+    rows = colony_rows(db_path, one["run_id"])
+    assert rows and {row[0] for row in rows} == {0, 1, 2, 3}
+    assert rows == colony_rows(db_path, two["run_id"])
+
+
+def test_runs_keep_earlier_runs(tmp_path):
+    db_path = str(tmp_path / "colonies.db")
+    first = run_colonies(2, max_steps=50, shards=1, seed=1, db_path=db_path)
+    kept = colony_rows(db_path, first["run_id"])
+    second = run_colonies(3, max_steps=80, shards=1, seed=2, db_path=db_path)
+    assert colony_rows(db_path, first["run_id"]) == kept
+    # Ett givet run_id ersätter bara den körningens rader
+    run_colonies(1, max_steps=30, shards=1, seed=4, db_path=db_path, run_id=second["run_id"])
+    assert colony_rows(db_path, first["run_id"]) == kept
+    assert {row[0] for row in colony_rows(db_path, second["run_id"])} == {0}
+    connection = sqlite3.connect(db_path)
+    try:
+        assert connection.execute("SELECT run_id, colonies FROM ColonyRuns ORDER BY run_id").fetchall() == [
+            (first["run_id"], 2), (second["run_id"], 1)]
+        assert connection.execute("SELECT run_id, COUNT(*) FROM Colonies GROUP BY run_id ORDER BY run_id").fetchall() == [
+            (first["run_id"], 2), (second["run_id"], 1)]
+    finally:
+        connection.close()
@@ -0,0 +1,148 @@
+import random
+from array import array
+from collections import deque
+
+import pytest
+
+from simsim import IndexRing, QualityBlocks
+
+
+# Funktion: assert_ring_equals - Jämför en IndexRing med en deque som referens
+def assert_ring_equals(ring, reference):
+    assert len(ring) == len(reference)
+    assert list(ring) == list(reference)
+    assert ring.to_array() == array('q', reference)
+
+
+def test_index_ring_wraps_and_grows():
+    ring, reference = IndexRing(4), deque()
+    for index in range(3):
+        ring.append(index)
+        reference.append(index)
+    assert ring.popleft() == reference.popleft() == 0
+    assert ring.popleft() == reference.popleft() == 1
+    # Huvudet ligger nu mitt i bufferten, så nästa tillägg går runt och det femte tvingar fram en tillväxt
+    for index in range(3, 9):
+        ring.append(index)
+        reference.append(index)
+    assert len(ring.buffer) == 8
+    assert_ring_equals(ring, reference)
+
+
+def test_index_ring_extend_across_wrap():
+    ring, reference = IndexRing(8), deque()
+    ring.extend(range(6))
+    reference.extend(range(6))
+    assert ring.popleft_many(5) == array('q', [reference.popleft() for _ in range(5)])
+    ring.extend(array('q', range(10, 16)))
+    reference.extend(range(10, 16))
+    assert ring.head + len(ring) > len(ring.buffer)
+    assert_ring_equals(ring, reference)
+    ring.extend([20, 21, 22])
+    reference.extend([20, 21, 22])
+    assert_ring_equals(ring, reference)
+
+
+def test_index_ring_popleft_many_more_than_size():
+    ring = IndexRing(4)
+    ring.extend([1, 2, 3])
+    assert ring.popleft_many(10) == array('q', [1, 2, 3])
+    assert len(ring) == 0 and ring.popleft_many(1) == array('q')
+
+
+def test_index_ring_empty_pops_raise():
+    ring = IndexRing()
+    with pytest.raises(IndexError):
+        ring.popleft()
+    with pytest.raises(IndexError):
+        ring.pop()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_index_ring_matches_deque(seed):
+    rng = random.Random(seed)
+    ring, reference = IndexRing(rng.choice([1, 2, 16])), deque()
+    next_index = 0
+    for iteration in range(5_000):
+        operation = rng.random()
+        if operation < 0.35:
+            ring.append(next_index)
+            reference.append(next_index)
+            next_index += 1
+        elif operation < 0.5:
+            count = rng.randrange(0, 40)
+            ring.extend(range(next_index, next_index + count))
+            reference.extend(range(next_index, next_index + count))
+            next_index += count
+        elif operation < 0.65:
+            count = rng.randrange(0, 40)
+            expected = [reference.popleft() for _ in range(min(count, len(reference)))]
+            assert ring.popleft_many(count) == array('q', expected)
+        elif operation < 0.85 and reference:
+            assert ring.popleft() == reference.popleft()
+        elif reference:
+            assert ring.pop() == reference.pop()
+        if iteration % 97 == 0:
+            assert_ring_equals(ring, reference)
+    assert_ring_equals(ring, reference)
+
+
+# Funktion: assert_blocks_equal - Jämför QualityBlocks med en lista av kvaliteter (en per enhet) som referens
+def assert_blocks_equal(blocks, reference):
+    assert len(blocks) == len(reference)
+    assert [quality for quality, count in blocks for _ in range(count)] == reference
+    # Intilliggande block har alltid olika kvalitet och inga tomma block
+    qualities = [quality for quality, _ in blocks]
+    assert all(a != b for a, b in zip(qualities, qualities[1:]))
+    assert all(count > 0 for _, count in blocks)
+
+
+def test_quality_blocks_merge_adjacent_appends():
+    blocks = QualityBlocks()
+    blocks.append(1, 3)
+    blocks.append(1)
+    blocks.append(2, 2)
+    blocks.append(1, 0)
+    blocks.append(1, 2)
+    assert list(blocks) == [(1, 4), (2, 2), (1, 2)]
+    assert len(blocks) == 8
+
+
+def test_quality_blocks_take_and_drop_split_blocks():
+    blocks = QualityBlocks()
+    for quality, count in ((1, 3), (2, 2), (3, 4)):
+        blocks.append(quality, count)
+    assert blocks.take(4) == [(1, 3), (2, 1)]
+    assert blocks.drop(3) == 3
+    assert list(blocks) == [(2, 1), (3, 1)]
+    assert blocks.take(10) == [(2, 1), (3, 1)]
+    assert blocks.drop(5) == 0 and blocks.take(1) == [] and len(blocks) == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_quality_blocks_match_list(seed):
+    rng = random.Random(seed)
+    blocks, reference = QualityBlocks(), []
+    for iteration in range(5_000):
+        operation = rng.random()
+        if operation < 0.4:
+            quality, count = rng.randrange(1, 4), rng.randrange(0, 6)
+            blocks.append(quality, count)
+            reference.extend([quality] * count)
+        elif operation < 0.55:
+            count = rng.randrange(0, 12)
+            taken = [quality for quality, n in blocks.take(count) for _ in range(n)]
+            assert taken == reference[:count]
+            del reference[:count]
+        elif operation < 0.7:
+            count = rng.randrange(0, 12)
+            removed = min(count, len(reference))
+            assert blocks.drop(count) == removed
+            del reference[len(reference) - removed:]
+        elif operation < 0.85 and reference:
+            assert blocks.popleft() == reference.pop(0)
+        elif reference:
+            assert blocks.pop() == reference.pop()
+        if iteration % 97 == 0:
+            assert_blocks_equal(blocks, reference)
+    assert_blocks_equal(blocks, reference)
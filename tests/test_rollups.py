@@ -0,0 +1,136 @@
+import random
+import sqlite3
+
+import pytest
+
+from simsim import RESOURCES, ROLLUP_RESOLUTIONS, SimulationLogger, SimulationQuery
+
+
+# Funktion: raw_rows - Alla råa rader (run_id, step, workers, food, products) i loggen
+def raw_rows(db_path):
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute("SELECT run_id, step, workers, food, products FROM SimulationLog").fetchall()
+    finally:
+        connection.close()
+
+
+# Funktion: brute_force_aggregate - Samma fönster som SimulationQuery.aggregate, räknade direkt från råa rader
+def brute_force_aggregate(rows, run_ids, start, stop, window):
+    rows = [row[1:] for row in rows if row[0] in run_ids and start <= row[1] < stop]
+    windows = {}
+    for step, *values in rows:
+        windows.setdefault(step // window, []).append(values)
+    result = []
+    for index in sorted(windows):
+        values = windows[index]
+        row = {"step": index * window, "count": len(values)}
+        for position, res in enumerate(RESOURCES):
+            column = [value[position] for value in values]
+            row[f"{res}_min"] = min(column)
+            row[f"{res}_max"] = max(column)
+            row[f"{res}_mean"] = sum(column) / len(column)
+        result.append(row)
+    return result
+
+
+# Funktion: write_run - Loggar steps steg med slumpvärden som en egen körning och returnerar dess run_id
+def write_run(db_path, steps, seed, first=0, run_id=None, batch_size=997):
+    rng = random.Random(seed)
+    with SimulationLogger(db_path, batch_size=batch_size, run_id=run_id) as logger:
+        logger.init_schema(reset=run_id is None)
+        for step in range(first, first + steps):
+            logger.log(step, rng.randint(0, 500), rng.randint(0, 500), rng.randint(0, 500))
+        return logger.run_id
+
+
+# Funktion: make_log_db - Databas med två överlappande körningar
+def make_log_db(db_path):
+    first = write_run(db_path, 13_457, seed=1)
+    second = write_run(db_path, 7_003, seed=2, first=500)
+    return db_path, raw_rows(db_path), first, second
+
+
+@pytest.fixture(scope="module")
+def log_db(tmp_path_factory):
+    return make_log_db(str(tmp_path_factory.mktemp("rollups") / "log.db"))
+
+
+@pytest.mark.parametrize("window", [1, 7, 10, 100, 250, 1000, 3000, 10_000, 20_000])
+@pytest.mark.parametrize("start, stop", [(0, 13_457), (1, 13_456), (999, 10_001), (4_321, 4_322),
+                                         (3_000, 13_000), (7_345, 12_222), (0, 50_000)])
+def test_aggregate_matches_raw_rows(log_db, window, start, stop):
+    db_path, rows, first, second = log_db
+    with SimulationQuery(db_path) as query:
+        for run_ids, run_filter in (([first], first), ([second], second), ([first, second], [first, second]),
+                                    ([first, second], None)):
+            assert query.aggregate(run_filter, start, stop, window) == (
+                brute_force_aggregate(rows, run_ids, start, stop, window))
+
+
+def test_aggregate_default_bounds_and_empty_range(log_db):
+    db_path, rows, first, second = log_db
+    with SimulationQuery(db_path) as query:
+        assert query.aggregate(second, window=100) == (
+            brute_force_aggregate(rows, [second], 500, 7_503, 100))
+        assert query.aggregate(first, 100, 100) == []
+        assert query.aggregate(first, 50_000, 60_000) == []
+
+
+def test_range_filters_runs(log_db):
+    db_path, _, first, second = log_db
+    with SimulationQuery(db_path) as query:
+        rows = query.range(second, 400, 510)
+        assert [row[1] for row in rows] == list(range(500, 510))
+        assert {row[0] for row in rows} == {second}
+        assert len(query.range([first, second], 400, 510)) == 110 + 10
+        assert [run["run_id"] for run in query.runs()] == [first, second]
+
+
+def test_rollups_follow_overwritten_rows(tmp_path):
+    db_path, _, first, _ = make_log_db(str(tmp_path / "log.db"))
+    # Skriv om en del av den första körningen utan reset; UPSERT ska ersätta raderna och deras rollups
+    write_run(db_path, 3_000, seed=3, first=8_000, run_id=first, batch_size=311)
+    rows = raw_rows(db_path)
+    with SimulationQuery(db_path) as query:
+        for window in (10, 1000, 10_000):
+            assert query.aggregate(first, 0, 13_457, window) == (
+                brute_force_aggregate(rows, [first], 0, 13_457, window))
+
+
+def test_stored_rollups_match_raw_rows(log_db):
+    db_path, _, first, _ = log_db
+    connection = sqlite3.connect(db_path)
+    try:
+        for resolution in ROLLUP_RESOLUTIONS:
+            stored = connection.execute(
+                "SELECT bucket, count, workers_min, workers_max, workers_sum FROM SimulationRollup "
+                "WHERE run_id = ? AND resolution = ? ORDER BY bucket", (first, resolution)).fetchall()
+            raw = connection.execute(
+                "SELECT step / ?, COUNT(*), MIN(workers), MAX(workers), SUM(workers) FROM SimulationLog "
+                "WHERE run_id = ? GROUP BY step / ? ORDER BY step / ?",
+                (resolution, first, resolution, resolution)).fetchall()
+            assert stored == raw
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("window", [1, 10, 100, 1000, 3000, 10_000, 20_000])
+def test_split_covers_range_with_aligned_pieces(tmp_path, window):
+    rng = random.Random(window)
+    levels = sorted((r for r in ROLLUP_RESOLUTIONS if window % r == 0), reverse=True)
+    with SimulationQuery(str(tmp_path / "empty.db")) as query:
+        for _ in range(200):
+            low = rng.randrange(0, 50_000)
+            high = low + rng.randrange(0, 50_000)
+            pieces = []
+            query._split(low, high, levels, pieces)
+            covered = sorted((start, stop) for _, start, stop in pieces)
+            position = low
+            for start, stop in covered:
+                assert start == position and start < stop
+                position = stop
+            assert position == high or (low == high and not pieces)
+            for resolution, start, stop in pieces:
+                assert resolution == 1 or resolution in levels
+                assert start % resolution == 0 and stop % resolution == 0
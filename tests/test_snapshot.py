@@ -0,0 +1,90 @@
+import sys
+from array import array
+
+import pytest
+
+from simsim import SNAPSHOT_MAGIC, SNAPSHOT_PREFIX, MemoryLogger, SimulationConfig, main, pack_snapshot, unpack_snapshot
+
+RESUME_CASES = [
+    ({}, None, None),
+    ({"columnar_workers": True, "counted_inventory": True}, None, None),
+    ({}, None, SimulationConfig(scheduler="event")),
+    ({}, None, SimulationConfig(scheduler="weighted")),
+    ({"columnar_workers": True, "counted_inventory": True}, 10, None),
+]
+
+
+# Funktion: run - Kör en ny simulation med fast seed till steget max_steps och returnerar den
+def run(options, max_steps, tau=None, config=None):
+    simulation = main(seed=5, logger=MemoryLogger(), config=config, **options)
+    simulation.run_headless(max_steps=max_steps, verbosity=0, tau=tau)
+    return simulation
+
+
+@pytest.mark.parametrize("options, tau, config", RESUME_CASES)
+@pytest.mark.parametrize("fraction", [0.0, 0.3, 0.9])
+def test_resume_matches_uninterrupted_run(options, tau, config, fraction):
+    full = run(options, 3000, tau, config)
+    # Delningen ligger på en loggad steggräns före körningens slut; med tau är det slutet av ett helt hopp,
+    # eftersom ett hopp annars kortas av vid max_steps och banan tar en annan väg
+    split = full.logger.rows[int(len(full.logger.rows) * fraction)][0] + 1
+    assert split < full.step
+    first = run(options, split, tau, config)
+    data = first.snapshot()
+    resumed = main.restore(data, logger=MemoryLogger())
+    assert resumed.snapshot() == data
+    resumed.run_headless(max_steps=3000, verbosity=0, tau=tau)
+    assert first.logger.rows + resumed.logger.rows == full.logger.rows
+    assert resumed.step == full.step
+
+
+def test_restore_from_checkpoint_file(tmp_path):
+    simulation = run({}, 200)
+    path = tmp_path / "checkpoint.bin"
+    simulation.save_checkpoint(path)
+    assert main.restore(str(path)).snapshot() == simulation.snapshot()
+
+
+def test_restore_rejects_wiring_changes():
+    data = run({}, 50).snapshot()
+    with pytest.raises(ValueError):
+        main.restore(data, config_changes={"factories": ((0, 1, 0),)})
+    assert main.restore(data, config_changes={"balance_margin": 0.5}).config.balance_margin == 0.5
+
+
+def test_fork_branches_differ_by_seed():
+    simulation = run({}, 200)
+    branches = simulation.fork(2, seed=1)
+    for branch in branches:
+        branch.run_headless(max_steps=600, verbosity=0)
+    assert branches[0].logger.rows != branches[1].logger.rows
+
+
+def test_pack_unpack_round_trip():
+    arrays = [("ids", array('q', [1, -2, 1 << 40])), ("vitality", array('h', [0, 100, -1])),
+              ("location", array('b', [0, 1, 2])), ("time", array('d', [0.5, 1e300])), ("empty", array('q'))]
+    header, unpacked = unpack_snapshot(pack_snapshot({"version": 1, "step": 7}, arrays))
+    assert header["version"] == 1 and header["step"] == 7
+    assert list(unpacked) == [name for name, _ in arrays]
+    for name, values in arrays:
+        assert unpacked[name] == values and unpacked[name].typecode == values.typecode
+
+
+def test_unpack_swaps_foreign_byteorder():
+    values = array('q', [1, 2, 1 << 40])
+    data = pack_snapshot({}, [("ids", values)])
+    # Bygg om ögonblicksbilden som om den skrivits på en maskin med motsatt byteordning
+    _, length = SNAPSHOT_PREFIX.unpack_from(data)
+    header = data[SNAPSHOT_PREFIX.size:SNAPSHOT_PREFIX.size + length]
+    foreign = "big" if sys.byteorder == "little" else "little"
+    header = header.replace(f'"byteorder":"{sys.byteorder}"'.encode(), f'"byteorder":"{foreign}"'.encode())
+    swapped = array('q', values)
+    swapped.byteswap()
+    data = SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, len(header)) + header + swapped.tobytes()
+    assert unpack_snapshot(data)[1]["ids"] == values
+
+
+def test_unpack_rejects_bad_magic():
+    data = pack_snapshot({}, [("ids", array('q', [1]))])
+    with pytest.raises(ValueError):
+        unpack_snapshot(b"NOTSNAP1" + data[8:])